@@ -0,0 +1,21 @@
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(path, mode='wb'):
+    """
+    Opens a temporary file next to path for writing and moves it over path once the block finishes, so readers never see
+    a partial file. The temporary file is named after the process, so concurrent writers of one path never share it
+    :param path: String
+    :param mode: String, 'wb' or 'w'
+    :return: File
+    """
+    temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(temporary_path, mode) as f:
+            yield f
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
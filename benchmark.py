@@ -0,0 +1,224 @@
+import json
+import multiprocessing
+import platform
+import time
+import resource
+import numpy as np
+from car import Car, ACTIONS
+from main import read_track
+from q_learning import QLearning
+from racetrack import RaceTrack
+from random_source import RandomSource
+from sarsa import Sarsa
+from tables import QTable, ValueTable
+from telemetry import Telemetry, QUIET, EPISODE
+from track_generator import generate_track, find_start
+from transition_table import NUM_VELOCITIES
+from value_iteration import ValueIteration
+
+
+# Shipped tracks and their start cells
+SHIPPED_TRACKS = {
+    'L-track.txt': (1, 8),
+    'O-track.txt': (2, 10),
+    'R-track.txt': (2, 26),
+    'custom-track.txt': (1, 10),
+}
+SYNTHETIC_SIZES = (10, 30, 100, 300, 1000)
+
+def benchmark_track(name, rows, cols, layout, start, max_states=2000000, num_sweeps=10, num_steps=20000, num_episodes=10,
+                    max_learning_states=100000, seed=0):
+    """
+    Measures construction, planning, environment and learning throughput on one track. Phases that need the
+    transition table are skipped above max_states, and learning above max_learning_states
+    :param name: String
+    :param rows: Int
+    :param cols: Int
+    :param layout: List
+    :param start: Tuple
+    :param max_states: Int
+    :param num_sweeps: Int
+    :param num_steps: Int
+    :param num_episodes: Int
+    :param max_learning_states: Int
+    :param seed: Int
+    :return: Dict
+    """
+    initial_state = (start[0], start[1], 0, 0)
+    num_states = sum(line[:cols].count('.') + line[:cols].count('S') + line[:cols].count('F') for line in layout[:rows]) * NUM_VELOCITIES
+    result = {'track': name, 'rows': rows, 'cols': cols, 'num_states': num_states}
+    try:
+        result = _benchmark_phases(result, rows, cols, layout, initial_state, max_states, num_sweeps, num_steps, num_episodes,
+                                   max_learning_states, seed)
+    finally:
+        # Process high-water mark (ru_maxrss is in kilobytes on Linux); only a per-track figure when the track runs in
+        # its own process, as run_benchmarks does
+        result['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return result
+
+def _benchmark_isolated(name, rows, cols, layout, start, options):
+    """
+    Runs benchmark_track in a fresh process, so its peak RSS covers that track alone
+    :param name: String
+    :param rows: Int
+    :param cols: Int
+    :param layout: List
+    :param start: Tuple
+    :param options: Dict passed through to benchmark_track
+    :return: Dict
+    """
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(benchmark_track, (name, rows, cols, layout, start), options)
+
+def _benchmark_phases(result, rows, cols, layout, initial_state, max_states, num_sweeps, num_steps, num_episodes,
+                      max_learning_states, seed):
+    """
+    Runs the benchmark phases in order, adding measurements to result
+    :param result: Dict
+    :param rows: Int
+    :param cols: Int
+    :param layout: List
+    :param initial_state: Tuple
+    :param max_states: Int
+    :param num_sweeps: Int
+    :param num_steps: Int
+    :param num_episodes: Int
+    :param max_learning_states: Int
+    :param seed: Int
+    :return: Dict
+    """
+    num_states = result['num_states']
+
+    # Environment steps with random accelerations
+    random_source = RandomSource(seed)
+    environment = RaceTrack(rows, cols, layout, initial_state, random_source=random_source)
+    action_ids = np.random.default_rng(seed).integers(len(ACTIONS), size=num_steps)
+    begin = time.perf_counter()
+    for action_id in action_ids:
+        environment.update_state(ACTIONS[action_id])
+        if environment.in_terminal_state():
+            environment.reset_state()
+    result['env_steps_per_sec'] = num_steps / (time.perf_counter() - begin)
+    result['collision_cache'] = environment.collision_oracle.stats()
+
+    if num_states > max_states:
+        result['skipped'] = 'tables and learning: more than {} states'.format(max_states)
+        return result
+
+    # Construction time of the transition table, value function and q table
+    environment = RaceTrack(rows, cols, layout, initial_state, random_source=random_source)
+    begin = time.perf_counter()
+    table = environment.compile()
+    result['transition_table_seconds'] = time.perf_counter() - begin
+    begin = time.perf_counter()
+    ValueTable(table)
+    result['value_function_seconds'] = time.perf_counter() - begin
+    begin = time.perf_counter()
+    QTable(table)
+    result['q_table_seconds'] = time.perf_counter() - begin
+
+    # Fixed number of vectorized sweeps
+    planner = ValueIteration(0.9, 0.0, num_sweeps, environment, Car((0, 0)), engine='vectorized', telemetry=Telemetry(QUIET))
+    begin = time.perf_counter()
+    planner.run()
+    seconds = time.perf_counter() - begin
+    result['vi_sweeps_per_sec'] = num_sweeps / seconds
+    result['vi_backups_per_sec'] = planner.num_backups / seconds
+
+    if num_states > max_learning_states:
+        result['skipped'] = 'learning: more than {} states'.format(max_learning_states)
+        return result
+    for key, learner_class in (('q_learning', QLearning), ('sarsa', Sarsa)):
+        random_source = RandomSource(seed)
+        environment.random_source = random_source
+        learner = learner_class(0.9, 0.9, 0, num_episodes, environment, Car((0, 0), 0.5, random_source=random_source), telemetry=Telemetry(QUIET))
+        begin = time.perf_counter()
+        learner.run()
+        seconds = time.perf_counter() - begin
+        result[key + '_episodes_per_sec'] = num_episodes / seconds
+        result[key + '_steps_per_sec'] = learner.telemetry.counters['steps'] / seconds
+    return result
+
+def measure_multigrid(name, rows, cols, layout, start, levels=(1, 2), discount=0.9, threshold=0.0001, max_iterations=10000,
+                      telemetry=None):
+    """
+    Compares cold-start vectorized Value Iteration against multigrid initialization with each number of levels
+    :param name: String
+    :param rows: Int
+    :param cols: Int
+    :param layout: List
+    :param start: Tuple
+    :param levels: Tuple of Ints
+    :param discount: Float
+    :param threshold: Float
+    :param max_iterations: Int
+    :param telemetry: Telemetry that each row is logged to
+    :return: List of Dicts with sweeps on the full track and coarse tracks, seconds, and sweeps and seconds saved
+    """
+    telemetry = Telemetry() if telemetry is None else telemetry
+    environment = RaceTrack(rows, cols, layout, (start[0], start[1], 0, 0))
+    environment.compile()
+    report = []
+    for num_levels in (0,) + tuple(levels):
+        planner = ValueIteration(discount, threshold, max_iterations, environment, Car((0, 0)), engine='vectorized',
+                                 telemetry=Telemetry(QUIET), multigrid_levels=num_levels)
+        begin = time.perf_counter()
+        values = planner.run().array
+        seconds = time.perf_counter() - begin
+        if not num_levels:
+            cold_values, cold_sweeps, cold_seconds = values, len(planner.max_diffs), seconds
+        report.append({'track': name, 'levels': num_levels, 'sweeps': len(planner.max_diffs), 'coarse_sweeps': planner.coarse_sweeps,
+                       'seconds': seconds, 'sweeps_saved': cold_sweeps - len(planner.max_diffs), 'seconds_saved': cold_seconds - seconds,
+                       'max_value_difference': float(np.max(np.abs(values - cold_values)))})
+        telemetry.log(EPISODE, report[-1])
+    return report
+
+def run_multigrid_report(sizes=(30, 100), **options):
+    """
+    Runs measure_multigrid on the shipped tracks and square synthetic tracks of given sizes
+    :param sizes: Tuple of Ints
+    :param options: Passed through to measure_multigrid
+    :return: List of Dicts
+    """
+    report = []
+    for name, start in SHIPPED_TRACKS.items():
+        rows, cols, layout = read_track(name)
+        report.extend(measure_multigrid(name, rows, cols, layout, start, **options))
+    for size in sizes:
+        layout = generate_track(size, size, seed=size)
+        report.extend(measure_multigrid('synthetic-{}x{}'.format(size, size), size, size, layout, find_start(layout), **options))
+    return report
+
+def run_benchmarks(output_path='benchmark_results.json', sizes=SYNTHETIC_SIZES, telemetry=None, **options):
+    """
+    Benchmarks the shipped tracks and square synthetic tracks of given sizes, each in its own process, and writes
+    results as JSON
+    :param output_path: String
+    :param sizes: Tuple of Ints
+    :param telemetry: Telemetry that each result is logged to
+    :param options: Passed through to benchmark_track
+    :return: List of Dicts
+    """
+    telemetry = Telemetry() if telemetry is None else telemetry
+    results = []
+    for name, start in SHIPPED_TRACKS.items():
+        rows, cols, layout = read_track(name)
+        results.append(_benchmark_isolated(name, rows, cols, layout, start, options))
+        telemetry.log(EPISODE, results[-1])
+    for size in sizes:
+        layout = generate_track(size, size, seed=size)
+        results.append(_benchmark_isolated('synthetic-{}x{}'.format(size, size), size, size, layout, find_start(layout), options))
+        telemetry.log(EPISODE, results[-1])
+    with open(output_path, 'w') as f:
+        json.dump({
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'results': results,
+        }, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    run_benchmarks()
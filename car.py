@@ -1,27 +1,34 @@
 import numpy as np
+from random_source import RandomSource
 
 
+# Action space, in the fixed order used by array-backed tables
+ACTIONS = ((-1, -1), (-1, 0), (0, -1), (0, 0), (0, 1), (1, 0), (1, 1))
+
 class Car:
     """
     Class for representing and abstracting Car agent
     """
-    def __init__(self, initial_action, epsilon=None, q_function=None):
+    def __init__(self, initial_action, epsilon=None, q_function=None, random_source=None):
         """
         Initializes Car class
         :param initial_action: Tuple
         :param epsilon: Float
-        :param q_function: Dict
+        :param q_function: Dict or QTable
+        :param random_source: RandomSource
         """
         self.initial_action = initial_action
         self.current_action = initial_action
         self.epsilon = epsilon
         self.q_function = q_function
-        self.possible_actions = {(-1, -1), (-1, 0), (0, 0), (0, -1), (0, 1), (1, 0), (1, 1)}
+        self.possible_actions = ACTIONS
+        self.random_source = RandomSource() if random_source is None else random_source
+        self.exploratory_actions = ((-1, -1), (-1, 0), (0, -1), (0, 0), (0, 1), (1, 0))
 
     def set_q_function(self, function):
         """
         Sets q function to given function
-        :param function: Dict
+        :param function: Dict or QTable
         :return: None
         """
         self.q_function = function
@@ -40,31 +47,47 @@ class Car:
         :param state: Tuple
         :return: Tuple
         """
-        # Choose among next possible state-action pairs
+        # Exploit with probability 1 - epsilon, otherwise take one of the exploratory actions uniformly
+        sample = self.random_source.uniform()
+        if sample < 1 - self.epsilon:
+            self.current_action = self.greedy_action(state)
+        else:
+            choice = int((sample - (1 - self.epsilon)) / self.epsilon * len(self.exploratory_actions))
+            self.current_action = self.exploratory_actions[min(choice, len(self.exploratory_actions) - 1)]
+        self.epsilon -= 0.001
+        self.epsilon = max(self.epsilon, 0.01)
+        return self.current_action
+
+    def take_actions(self, state_ids):
+        """
+        Chooses epsilon-greedy actions for a batch of cars at once, decaying epsilon once per car
+        :param state_ids: Array of dense state ids into the QTable
+        :return: Array of action indices
+        """
+        samples = self.random_source.uniforms(len(state_ids))
+        action_ids = np.argmin(self.q_function.array[state_ids], axis=1)
+        explore = samples >= 1 - self.epsilon
+        exploratory_ids = np.array([self.possible_actions.index(action) for action in self.exploratory_actions])
+        choices = ((samples[explore] - (1 - self.epsilon)) / self.epsilon * len(exploratory_ids)).astype(int)
+        action_ids[explore] = exploratory_ids[np.minimum(choices, len(exploratory_ids) - 1)]
+        self.epsilon = max(self.epsilon - 0.001 * len(state_ids), 0.01)
+        return action_ids
+
+    def greedy_action(self, state):
+        """
+        Returns action with lowest q value in given state
+        :param state: Tuple
+        :return: Tuple
+        """
+        if hasattr(self.q_function, 'greedy_action'):
+            return self.q_function.greedy_action(state)
         optimal_action, optimal_value = None, np.inf
         for action in self.possible_actions:
             value = self.q_function[(state, action)]
             if value < optimal_value:
                 optimal_value = value
                 optimal_action = action
-        # Choose action probabilistically
-        action_map = {
-            0: optimal_action,
-            1: (-1, -1),
-            2: (-1, 0),
-            3: (0, -1),
-            4: (0, 0),
-            5: (0, 1),
-            6: (1, 0),
-            7: (1, 10)
-        }
-        probability = self.epsilon/6.0
-        probabilities = [1 - self.epsilon] + [probability for _ in range(6)]
-        taken_action = np.random.choice([_ for _ in range(7)], p=probabilities)
-        self.current_action = action_map[taken_action]
-        self.epsilon -= 0.001
-        self.epsilon = max(self.epsilon, 0.01)
-        return self.current_action
+        return optimal_action
 
     def get_current_action(self):
         """
@@ -76,6 +99,6 @@ class Car:
     def get_all_actions(self):
         """
         Returns action space
-        :return: Set
+        :return: Tuple
         """
         return self.possible_actions
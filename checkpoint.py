@@ -0,0 +1,97 @@
+import json
+import struct
+import numpy as np
+from atomic_file import atomic_write
+
+
+# File layout: magic, format version, header length, JSON header, then 64-byte aligned raw arrays
+MAGIC = b'RLCKPT'
+VERSION = 1
+ALIGNMENT = 64
+PREAMBLE = struct.Struct('<6sHI')
+
+class Checkpoint:
+    """
+    Class for a memory-mapped value function or q table checkpoint
+    """
+    def __init__(self, path):
+        """
+        Opens checkpoint; arrays are memory-mapped read-only, so even large tables open instantly
+        :param path: String
+        """
+        with open(path, 'rb') as f:
+            magic, version, header_length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+            if magic != MAGIC:
+                raise ValueError("Not a checkpoint file: " + path)
+            if version > VERSION:
+                raise ValueError("Unsupported checkpoint version {} in {}".format(version, path))
+            header = json.loads(f.read(header_length).decode('utf-8'))
+        self.path = path
+        self.version = version
+        self.kind = header['kind']
+        self.metadata = header['metadata']
+        arrays = {}
+        for name, spec in header['arrays'].items():
+            arrays[name] = np.memmap(path, dtype=spec['dtype'], mode='r', offset=spec['offset'], shape=tuple(spec['shape']))
+        self.states = arrays['states']
+        self.values = arrays['values']
+
+    def values_for(self, transition_table, fill_value=0.0):
+        """
+        Maps checkpointed values onto given table's state order by (x, y, vx, vy), so a checkpoint from a
+        slightly edited track still warm-starts every state the two tracks share
+        :param transition_table: TransitionTable
+        :param fill_value: Float, value of states missing from the checkpoint
+        :return: Array, shaped (num_states,) or (num_states, num_actions) like the checkpoint
+        """
+        values = np.full((transition_table.num_states,) + self.values.shape[1:], fill_value)
+        states = np.asarray(self.states, dtype=np.int64)
+        in_bounds = (states[:, 0] >= 0) & (states[:, 0] < transition_table.num_cols) & \
+                    (states[:, 1] >= 0) & (states[:, 1] < transition_table.num_rows)
+        states = states[in_bounds]
+        on_track = transition_table.cell_index[states[:, 1], states[:, 0]] >= 0
+        state_ids = np.full(len(states), -1, dtype=np.int64)
+        state_ids[on_track] = transition_table.encode_many(states[on_track])
+        found = state_ids >= 0
+        values[state_ids[found]] = np.asarray(self.values)[in_bounds][found]
+        return values
+
+def save_checkpoint(path, transition_table, values, kind, **metadata):
+    """
+    Writes value function or q table with its state index; the file is replaced atomically
+    :param path: String
+    :param transition_table: TransitionTable
+    :param values: Array, (num_states,) for kind 'value' or (num_states, num_actions) for kind 'q'
+    :param kind: String, 'value' or 'q'
+    :param metadata: JSON-serializable run information, e.g. iteration
+    :return: None
+    """
+    arrays = {
+        'states': transition_table.decode_many(np.arange(transition_table.num_states)).astype(np.int16),
+        'values': np.ascontiguousarray(values, dtype=np.float64),
+    }
+    # Offsets depend on header length, which depends on offsets; a fixed-width header breaks the cycle
+    specs = {name: {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': 0} for (name, array) in arrays.items()}
+    header = {'kind': kind, 'metadata': metadata, 'arrays': specs}
+    header_length = len(json.dumps(header).encode('utf-8')) + 64
+    offset = PREAMBLE.size + header_length
+    for name, array in arrays.items():
+        offset += -offset % ALIGNMENT
+        specs[name]['offset'] = offset
+        offset += array.nbytes
+    encoded = json.dumps(header).encode('utf-8').ljust(header_length)
+
+    with atomic_write(path) as f:
+        f.write(PREAMBLE.pack(MAGIC, VERSION, header_length))
+        f.write(encoded)
+        for name, array in arrays.items():
+            f.write(b'\0' * (specs[name]['offset'] - f.tell()))
+            f.write(array.tobytes())
+
+def load_checkpoint(path):
+    """
+    Opens checkpoint
+    :param path: String
+    :return: Checkpoint
+    """
+    return Checkpoint(path)
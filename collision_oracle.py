@@ -0,0 +1,93 @@
+from collections import OrderedDict
+
+
+class CollisionOracle:
+    """
+    Class for memoizing where straight-line moves across the track first hit a wall
+    """
+    def __init__(self, environment, max_size=None):
+        """
+        Initializes class
+        :param environment: RaceTrack
+        :param max_size: Int, bounds the cache with least-recently-used eviction; unbounded if None
+        """
+        self.environment = environment
+        self.max_size = max_size
+        self.cache = OrderedDict() if max_size is not None else {}
+        self.hits = 0
+        self.misses = 0
+
+    def first_hit(self, x0, y0, x1, y1):
+        """
+        Returns last free position along the line from (x0, y0) to (x1, y1) and whether a wall was hit
+        :param x0: Int
+        :param y0: Int
+        :param x1: Int
+        :param y1: Int
+        :return: Tuple
+        """
+        key = (x0, y0, x1 - x0, y1 - y0)
+        result = self.cache.get(key)
+        if result is not None:
+            self.hits += 1
+            if self.max_size is not None:
+                self.cache.move_to_end(key)
+            return result
+        self.misses += 1
+        result = self.__trace(x0, y0, x1, y1)
+        self.cache[key] = result
+        if self.max_size is not None and len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+        return result
+
+    def __trace(self, x0, y0, x1, y1):
+        """
+        Walks Bresenham line until the first wall
+        :param x0: Int
+        :param y0: Int
+        :param x1: Int
+        :param y1: Int
+        :return: Tuple
+        """
+        wall_mask = self.environment.track.wall_mask
+        x_position, y_position = x1, y1
+        for x, y in self.environment.bresenham(x0, y0, x1, y1):
+            if wall_mask[y, x]:
+                return x_position, y_position, True
+            x_position, y_position = x, y
+        return x_position, y_position, False
+
+    def precompute(self, min_velocity, max_velocity):
+        """
+        Resolves every move from every free cell with velocities in given range
+        :param min_velocity: Int
+        :param max_velocity: Int
+        :return: None
+        """
+        environment = self.environment
+        for y in range(environment.num_rows):
+            for x in range(environment.num_cols):
+                if environment.track.wall_mask[y, x]:
+                    continue
+                for vx in range(min_velocity, max_velocity + 1):
+                    for vy in range(min_velocity, max_velocity + 1):
+                        x1 = min(max(x + vx, 0), environment.num_cols)
+                        y1 = min(max(y + vy, 0), environment.num_rows)
+                        self.first_hit(x, y, x1, y1)
+
+    def clear(self):
+        """
+        Empties cache and resets counters
+        :return: None
+        """
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """
+        Returns cache counters
+        :return: Dict
+        """
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.cache), 'hit_rate': self.hits / total if total else 0.0}
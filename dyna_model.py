@@ -0,0 +1,74 @@
+import numpy as np
+
+
+class DynaModel:
+    """
+    Class for an array-backed model of observed transitions, replayed for Dyna-style planning. Each state-action
+    pair keeps its two most frequent distinct outcomes with visit counts, which covers the success and failure
+    outcome of every racetrack move
+    """
+    def __init__(self, num_states, num_actions, capacity=1024):
+        """
+        Initializes empty model
+        :param num_states: Int
+        :param num_actions: Int
+        :param capacity: Int, initial size of the buffer of observed pairs; grows as needed
+        """
+        self.num_actions = num_actions
+        self.next_states = np.full((num_states * num_actions, 2), -1, dtype=np.int32)
+        self.rewards = np.zeros((num_states * num_actions, 2))
+        self.counts = np.zeros((num_states * num_actions, 2), dtype=np.int32)
+        self.observed = np.empty(capacity, dtype=np.int64)
+        self.num_observed = 0
+
+    def record(self, state_id, action_id, next_id, reward):
+        """
+        Records one observed transition
+        :param state_id: Int
+        :param action_id: Int
+        :param next_id: Int
+        :param reward: Float
+        :return: None
+        """
+        pair = state_id * self.num_actions + action_id
+        outcomes = self.next_states[pair]
+        counts = self.counts[pair]
+        if outcomes[0] < 0:
+            if self.num_observed == len(self.observed):
+                self.observed = np.concatenate((self.observed, np.empty_like(self.observed)))
+            self.observed[self.num_observed] = pair
+            self.num_observed += 1
+        if outcomes[0] == next_id or outcomes[0] < 0:
+            slot = 0
+        elif outcomes[1] == next_id or outcomes[1] < 0:
+            slot = 1
+        else:
+            # A third outcome replaces the rarer one
+            slot = int(np.argmin(counts))
+            counts[slot] = 0
+        outcomes[slot] = next_id
+        self.rewards[pair, slot] = reward
+        counts[slot] += 1
+
+    def plan(self, q_values, num_backups, discount, learning_rate, random_source):
+        """
+        Applies expected q-learning backups under the model to observed pairs sampled uniformly
+        :param q_values: Array of shape (num_states, num_actions), updated in place
+        :param num_backups: Int
+        :param discount: Float
+        :param learning_rate: Float
+        :param random_source: RandomSource
+        :return: None
+        """
+        if not self.num_observed:
+            return
+        samples = (random_source.uniforms(num_backups) * self.num_observed).astype(np.int64)
+        pairs = self.observed[np.minimum(samples, self.num_observed - 1)]
+        counts = self.counts[pairs]
+        probabilities = counts / counts.sum(axis=1, keepdims=True)
+        # Unseen second outcomes have probability zero; any valid index keeps the lookup in bounds
+        next_values = q_values[np.maximum(self.next_states[pairs], 0)].min(axis=2)
+        targets = (probabilities * (self.rewards[pairs] + discount * next_values)).sum(axis=1)
+        flat_q_values = q_values.reshape(-1)
+        # A pair sampled twice gets the same update from the same old value, so the repeated write is harmless
+        flat_q_values[pairs] += learning_rate * (targets - flat_q_values[pairs])
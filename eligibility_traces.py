@@ -0,0 +1,76 @@
+import numpy as np
+
+
+class EligibilityTraces:
+    """
+    Class for sparse eligibility traces over flat state-action indices. Only nonzero traces are tracked, and decay
+    is applied lazily through a shared scale, so every operation costs O(active traces)
+    """
+    def __init__(self, size, replacing=False, min_trace=1e-4, capacity=1024):
+        """
+        Initializes empty traces
+        :param size: Int, number of state-action pairs
+        :param replacing: Boolean, a visit resets the trace to 1 instead of adding 1
+        :param min_trace: Float, traces that decay below this are dropped
+        :param capacity: Int, initial size of the active index buffer; grows as needed
+        """
+        self.replacing = replacing
+        self.min_trace = min_trace
+        # A trace is values[index] * scale; values is zero exactly for inactive indices
+        self.values = np.zeros(size)
+        self.scale = 1.0
+        self.active = np.empty(capacity, dtype=np.int64)
+        self.num_active = 0
+
+    def clear(self):
+        """
+        Zeroes all traces
+        :return: None
+        """
+        self.values[self.active[:self.num_active]] = 0.0
+        self.num_active = 0
+        self.scale = 1.0
+
+    def visit(self, index):
+        """
+        Bumps trace of given state-action pair
+        :param index: Int
+        :return: None
+        """
+        if self.values[index] == 0.0:
+            if self.num_active == len(self.active):
+                self.active = np.concatenate((self.active, np.empty_like(self.active)))
+            self.active[self.num_active] = index
+            self.num_active += 1
+        if self.replacing:
+            self.values[index] = 1.0 / self.scale
+        else:
+            self.values[index] += 1.0 / self.scale
+
+    def apply(self, target, step):
+        """
+        Adds step times each trace to target
+        :param target: Flat Array indexed like the traces, e.g. a q table's array.reshape(-1)
+        :param step: Float, e.g. learning rate times temporal difference
+        :return: None
+        """
+        active = self.active[:self.num_active]
+        target[active] += step * self.scale * self.values[active]
+
+    def decay(self, factor):
+        """
+        Multiplies all traces by factor, folding the scale back in and dropping negligible traces once it gets small
+        :param factor: Float, discount times lambda
+        :return: None
+        """
+        self.scale *= factor
+        if self.scale >= self.min_trace:
+            return
+        active = self.active[:self.num_active]
+        traces = self.values[active] * self.scale
+        keep = traces >= self.min_trace
+        self.values[active[~keep]] = 0.0
+        self.values[active[keep]] = traces[keep]
+        self.num_active = int(np.count_nonzero(keep))
+        self.active[:self.num_active] = active[keep]
+        self.scale = 1.0
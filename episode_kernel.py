@@ -0,0 +1,180 @@
+import numpy as np
+from car import ACTIONS
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# Exploratory actions as ids into ACTIONS, in Car's order
+EXPLORATORY_ACTION_IDS = np.array([ACTIONS.index(action) for action in ((-1, -1), (-1, 0), (0, -1), (0, 0), (0, 1), (1, 0))])
+
+def choose_action(q_values, state_id, num_actions, exploratory_ids, epsilon, sample):
+    """
+    Chooses an epsilon-greedy action from one uniform variate exactly as Car.take_action does
+    :param q_values: Flat Array of q values
+    :param state_id: Int
+    :param num_actions: Int
+    :param exploratory_ids: Array
+    :param epsilon: Float
+    :param sample: Float
+    :return: Tuple of action id and decayed epsilon
+    """
+    if sample < 1 - epsilon:
+        offset = state_id * num_actions
+        action_id = 0
+        for candidate in range(1, num_actions):
+            if q_values[offset + candidate] < q_values[offset + action_id]:
+                action_id = candidate
+    else:
+        choice = int((sample - (1 - epsilon)) / epsilon * len(exploratory_ids))
+        action_id = exploratory_ids[min(choice, len(exploratory_ids) - 1)]
+    return action_id, max(epsilon - 0.001, 0.01)
+
+def episode_steps(q_values, num_actions, next_success, next_fail, terminal, reward, exploratory_ids, success_prob, uniforms,
+                  position, state_id, action_id, epsilon, learning_rate, discount, sarsa, path):
+    """
+    Runs learner steps from given state until the episode ends, the variates run out or the path buffer fills.
+    Consumes one variate per action choice and one per transition, in the reference learners' order
+    :param q_values: Flat Array of q values, updated in place
+    :param num_actions: Int
+    :param next_success: Flat Array of successor ids by state id * num_actions + action id
+    :param next_fail: Array of successor ids by state id
+    :param terminal: Array
+    :param reward: Array
+    :param exploratory_ids: Array
+    :param success_prob: Float
+    :param uniforms: Array of uniform variates
+    :param position: Int, index of the next unused variate
+    :param state_id: Int
+    :param action_id: Int, action already chosen in state (Sarsa), or -1
+    :param epsilon: Float
+    :param learning_rate: Float
+    :param discount: Float
+    :param sarsa: Boolean, Sarsa's step order instead of QLearning's
+    :param path: Array that visited state ids are written to
+    :return: Tuple of state id, pending action id, epsilon, next unused variate, path length and whether the episode ended
+    """
+    length = 0
+    if sarsa and action_id < 0:
+        if position >= len(uniforms):
+            return state_id, action_id, epsilon, position, length, False
+        action_id, epsilon = _choose_action(q_values, state_id, num_actions, exploratory_ids, epsilon, uniforms[position])
+        position += 1
+    needed = 2 if sarsa else 3
+    while not terminal[state_id]:
+        if position + needed > len(uniforms) or length >= len(path):
+            return state_id, action_id, epsilon, position, length, False
+        if not sarsa:
+            action_id, epsilon = _choose_action(q_values, state_id, num_actions, exploratory_ids, epsilon, uniforms[position])
+            position += 1
+        if uniforms[position] < success_prob:
+            next_id = next_success[state_id * num_actions + action_id]
+        else:
+            next_id = next_fail[state_id]
+        position += 1
+        next_action_id, epsilon = _choose_action(q_values, next_id, num_actions, exploratory_ids, epsilon, uniforms[position])
+        position += 1
+        pair = state_id * num_actions + action_id
+        current_q = q_values[pair]
+        next_q = q_values[next_id * num_actions + next_action_id]
+        q_values[pair] = current_q + learning_rate * (reward[next_id] + discount * next_q - current_q)
+        path[length] = next_id
+        length += 1
+        state_id = next_id
+        action_id = next_action_id
+    return state_id, action_id, epsilon, position, length, True
+
+if numba is not None:
+    _choose_action = numba.njit(cache=True)(choose_action)
+    _episode_steps = numba.njit(cache=True)(episode_steps)
+else:
+    _choose_action = choose_action
+    _episode_steps = episode_steps
+
+class EpisodeKernel:
+    """
+    Class for running whole learner episodes over a QTable's arrays in one compiled kernel. Without Numba the same
+    kernel runs as plain Python over lists, which index faster than arrays; call sync before reading the q table
+    """
+    def __init__(self, q_function, sarsa=False, path_capacity=4096, in_place=False):
+        """
+        Initializes kernel
+        :param q_function: QTable
+        :param sarsa: Boolean, Sarsa's step order instead of QLearning's
+        :param path_capacity: Int, states recorded per kernel call
+        :param in_place: Boolean, always update the QTable's array directly, e.g. when other processes share it
+        """
+        table = q_function.transition_table
+        self.transition_table = table
+        self.q_function = q_function
+        self.compiled = numba is not None
+        self.in_place = in_place or self.compiled
+        self.num_actions = table.num_actions
+        self.success_prob = table.success_prob
+        self.sarsa = sarsa
+        arrays = {
+            'q_values': q_function.array.reshape(-1),
+            'next_success': np.ascontiguousarray(table.next_success).reshape(-1),
+            'next_fail': np.ascontiguousarray(table.next_fail[:, 0]),
+            'terminal': table.terminal,
+            'reward': table.reward,
+            'exploratory_ids': EXPLORATORY_ACTION_IDS,
+            'path': np.empty(path_capacity, dtype=np.int64),
+        }
+        for name, array in arrays.items():
+            setattr(self, name, array if self.in_place else array.tolist())
+        self.block = None
+        self.uniforms = None
+
+    def run_episode(self, initial_state, agent, learning_rate, discount, random_source):
+        """
+        Runs one episode from given state, consuming agent's epsilon and the random source like the reference learners
+        :param initial_state: Tuple
+        :param agent: Car
+        :param learning_rate: Float
+        :param discount: Float
+        :param random_source: RandomSource
+        :return: Array of visited state ids, starting with the initial state
+        """
+        state_id = self.transition_table.encode(initial_state)
+        action_id = -1
+        epsilon = agent.epsilon
+        chunks = [np.array([state_id])]
+        done = False
+        while not done:
+            block, position = random_source.current_block(3)
+            if block is not self.block:
+                self.block = block
+                self.uniforms = block if self.in_place else block.tolist()
+            state_id, action_id, epsilon, next_position, length, done = _episode_steps(
+                self.q_values, self.num_actions, self.next_success, self.next_fail, self.terminal, self.reward, self.exploratory_ids,
+                self.success_prob, self.uniforms, position, state_id, action_id, epsilon, learning_rate, discount, self.sarsa, self.path)
+            random_source.advance(next_position - position)
+            chunks.append(np.array(self.path[:length], dtype=np.int64))
+        agent.epsilon = epsilon
+        if action_id >= 0:
+            agent.set_action(ACTIONS[action_id])
+        return np.concatenate(chunks)
+
+    def sync(self):
+        """
+        Copies q values back into the QTable; a no-op when the kernel updates it in place
+        :return: None
+        """
+        if not self.in_place:
+            self.q_function.array.reshape(-1)[:] = self.q_values
+
+    def decode_path(self, path, environment):
+        """
+        Turns state ids returned by run_episode into state tuples, leaving environment in the last state as the
+        reference learners do
+        :param path: Array of state ids
+        :param environment: RaceTrack
+        :return: List
+        """
+        path = [tuple(state) for state in self.transition_table.decode_many(np.asarray(path, dtype=np.int64)).tolist()]
+        if path:
+            environment.set_state(path[-1])
+        return path
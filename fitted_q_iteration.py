@@ -0,0 +1,79 @@
+import numpy as np
+from telemetry import Telemetry, EPISODE
+
+
+class FittedQIteration:
+    """
+    Class that implements offline fitted Q-iteration over a TrajectoryLog. Each iteration regresses every logged
+    state-action pair onto its replayed targets r + discount * min Q(s'), which for a table is the mean target, so no
+    environment is needed
+    """
+    def __init__(self, discount, threshold, max_iterations, log, batch_size=1048576, telemetry=None, initial_q=None):
+        """
+        Initializes algorithm
+        :param discount: Float
+        :param threshold: Float, stops once no q value changes by more than this in an iteration
+        :param max_iterations: Int
+        :param log: TrajectoryLog
+        :param batch_size: Int, transitions replayed per vectorized minibatch
+        :param telemetry: Telemetry
+        :param initial_q: Array of shape (num_states, num_actions) to start from instead of zeros; also the value of
+        pairs the log never visits
+        """
+        self.discount = discount
+        self.threshold = threshold
+        self.max_iterations = max_iterations
+        self.log = log
+        self.batch_size = batch_size
+        self.telemetry = Telemetry() if telemetry is None else telemetry
+        self.initial_q = initial_q
+        self.q_values = None
+
+    @property
+    def max_diffs(self):
+        """
+        Returns maximum q value difference of every iteration
+        :return: List
+        """
+        return self.telemetry.history('max_diff')
+
+    def run(self):
+        """
+        Runs algorithm
+        :return: Array of shape (num_states, num_actions)
+        """
+        columns = self.log.columns()
+        num_states, num_actions = self.log.num_states, self.log.num_actions
+        shape = (num_states, num_actions)
+        q_values = np.zeros(shape) if self.initial_q is None else np.array(self.initial_q, dtype=np.float64)
+
+        # Visit counts per pair do not change between iterations
+        counts = np.zeros(num_states * num_actions)
+        for start in range(0, len(columns['state_ids']), self.batch_size):
+            batch = slice(start, start + self.batch_size)
+            pairs = columns['state_ids'][batch].astype(np.int64) * num_actions + columns['action_ids'][batch]
+            counts += np.bincount(pairs, minlength=counts.size)
+        visited = counts > 0
+
+        max_difference = np.inf
+        i = 0
+        while i < self.max_iterations and max_difference > self.threshold:
+            next_values = q_values.min(axis=1)
+            sums = np.zeros(num_states * num_actions)
+            for start in range(0, len(columns['state_ids']), self.batch_size):
+                batch = slice(start, start + self.batch_size)
+                pairs = columns['state_ids'][batch].astype(np.int64) * num_actions + columns['action_ids'][batch]
+                continuing = ~columns['done'][batch]
+                targets = columns['rewards'][batch] + self.discount * continuing * next_values[columns['next_state_ids'][batch]]
+                sums += np.bincount(pairs, weights=targets, minlength=sums.size)
+            new_q_values = q_values.reshape(-1).copy()
+            new_q_values[visited] = sums[visited] / counts[visited]
+            max_difference = np.max(np.abs(new_q_values - q_values.reshape(-1))) if new_q_values.size else 0.0
+            q_values = new_q_values.reshape(shape)
+            self.telemetry.log(EPISODE, "Maximum difference: ", max_difference)
+            self.telemetry.record('max_diff', max_difference)
+            i += 1
+            self.telemetry.log(EPISODE, "Iterations: ", i)
+        self.telemetry.flush()
+        self.q_values = q_values
+        return q_values
@@ -0,0 +1,205 @@
+import queue
+import time
+import numpy as np
+from collections import deque
+from multiprocessing import Event, Process, Queue, shared_memory
+from car import Car
+from episode_kernel import EpisodeKernel
+from q_learning import QLearning
+from random_source import RandomSource
+from tables import QTable
+from telemetry import Telemetry, EPISODE, QUIET
+
+
+def _run_worker(worker_id, spec, transition_table, initial_state, seed, epsilon, learning_rate, discount, costs, stop):
+    """
+    Worker process: runs Q-learning episodes against the shared q table without locks until stop is set, reporting
+    each episode's cost and finally its last path
+    :param worker_id: Int
+    :param spec: Tuple of shared memory name, shape and dtype of the q table
+    :param transition_table: TransitionTable
+    :param initial_state: Tuple
+    :param seed: numpy.random.SeedSequence, this worker's own stream
+    :param epsilon: Float, start of this worker's own epsilon schedule
+    :param learning_rate: Float
+    :param discount: Float
+    :param costs: Queue of (worker id, cost, path) tuples; path is None except in the final message, whose cost is 0
+    :param stop: Event
+    :return: None
+    """
+    block_name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=block_name)
+    try:
+        q_function = QTable(transition_table, np.ndarray(shape, dtype=dtype, buffer=block.buf))
+        random_source = RandomSource(np.random.default_rng(seed))
+        agent = Car((0, 0), epsilon, q_function=q_function, random_source=random_source)
+        kernel = EpisodeKernel(q_function, in_place=True)
+        path = np.array([transition_table.encode(initial_state)])
+        while not stop.is_set():
+            path = kernel.run_episode(initial_state, agent, learning_rate, discount, random_source)
+            learning_rate = max(learning_rate - 0.0001, 0.001)
+            costs.put((worker_id, len(path), None))
+        costs.put((worker_id, 0, path))
+        del q_function, kernel
+    finally:
+        block.close()
+
+class HogwildQLearning(QLearning):
+    """
+    Class that implements Hogwild-style Q-Learning: worker processes run their own episodes and apply lock-free
+    updates to one q table in shared memory, while this process only tracks costs and decides when to stop
+    """
+    def __init__(self, discount, learning_rate, threshold, max_iterations, environment, agent, num_workers=2, seed=None,
+                 telemetry=None, initial_q=None, checkpoint_path=None, checkpoint_every=None):
+        """
+        Initializes algorithm
+        :param discount: Float
+        :param learning_rate: Float, start of each worker's learning rate schedule
+        :param threshold: Float
+        :param max_iterations: Int, episodes across all workers
+        :param environment: RaceTrack
+        :param agent: Car, its epsilon starts each worker's epsilon schedule
+        :param num_workers: Int
+        :param seed: Int, spawns an independent random stream per worker
+        :param telemetry: Telemetry
+        :param initial_q: Array of shape (num_states, num_actions) in transition table order to start from instead of zeros
+        :param checkpoint_path: String, q table is checkpointed here at the end of the run, also an interrupted one
+        :param checkpoint_every: Int, also checkpoint every this many episodes
+        """
+        super().__init__(discount, learning_rate, threshold, max_iterations, environment, agent, telemetry=telemetry,
+                         initial_q=initial_q, checkpoint_path=checkpoint_path, checkpoint_every=checkpoint_every)
+        self.num_workers = num_workers
+        self.seed = seed
+        self.num_episodes = 0
+
+    def run(self):
+        """
+        Runs algorithm; episodes of all workers feed one 25-episode moving average, in the order they finish
+        :return: List, last path of the first worker
+        """
+        table = self.environment.compile()
+        self.all_actions = self.agent.get_all_actions()
+        shape = (table.num_states, table.num_actions)
+        block = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 8)
+        workers = []
+        q_values = None
+        i = 0
+        try:
+            q_values = np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+            q_values[...] = 0.0 if self.initial_q is None else self.initial_q
+            # Periodic checkpoints read the shared table while workers update it
+            self.q_function = QTable(table, q_values)
+            costs = Queue()
+            stop = Event()
+            seeds = np.random.SeedSequence(self.seed).spawn(self.num_workers)
+            for worker_id in range(self.num_workers):
+                worker = Process(target=_run_worker, args=(worker_id, (block.name, shape, np.float64), table, self.environment.initial_state,
+                                                           seeds[worker_id], self.agent.epsilon, self.learning_rate,
+                                                           self.discount, costs, stop))
+                worker.start()
+                workers.append(worker)
+
+            q = deque(maxlen=25)
+            cost = np.inf
+            while cost > self.threshold and i < self.max_iterations:
+                worker_id, length, _ = self.__next_message(costs, workers)
+                self.telemetry.record('episode_cost', length)
+                self.telemetry.increment('steps', length - 1)
+                q.appendleft(length)
+                if len(q) == 25:
+                    cost = sum(q) / len(q)
+                    self.telemetry.log(EPISODE, "Average cost: ", cost)
+                    self.telemetry.record('avg_cost', cost)
+                    q.pop()
+                i += 1
+                self.telemetry.log(EPISODE, "Iterations: ", i, '--------------------------------------------')
+                if self.checkpoint_every and i % self.checkpoint_every == 0:
+                    self.save_checkpoint(i)
+            stop.set()
+            self.num_episodes = i
+
+            # Workers finish their current episode; their queue must be drained before they can exit
+            path = []
+            remaining = len(workers)
+            while remaining:
+                worker_id, length, final_path = self.__next_message(costs, workers)
+                if final_path is not None:
+                    remaining -= 1
+                    if worker_id == 0:
+                        path = final_path
+            for worker in workers:
+                worker.join()
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+            # The shared table is copied out before its memory is released; an interrupted run still checkpoints it
+            if q_values is not None:
+                self.q_function = QTable(table, q_values.copy())
+                del q_values
+                self.save_checkpoint(i)
+            block.close()
+            block.unlink()
+        self.agent.set_q_function(self.q_function)
+        self.telemetry.log(EPISODE, "Finished training---------------------------------------")
+        self.telemetry.flush()
+        path = [tuple(state) for state in table.decode_many(np.asarray(path, dtype=np.int64)).tolist()]
+        if path:
+            self.environment.set_state(path[-1])
+        return path
+
+    def run_batched(self, environment):
+        """
+        Not supported: workers each drive one car
+        :param environment: VectorRaceTrack
+        :return: None
+        """
+        raise ValueError("HogwildQLearning does not run batched cars; use QLearning.run_batched")
+
+    def __next_message(self, costs, workers):
+        """
+        Waits for the next worker message, failing instead of hanging if a worker died
+        :param costs: Queue
+        :param workers: List of Processes
+        :return: Tuple
+        """
+        while True:
+            try:
+                return costs.get(timeout=1)
+            except queue.Empty:
+                for worker in workers:
+                    if worker.exitcode not in (None, 0):
+                        raise RuntimeError("Worker process exited with code {}".format(worker.exitcode))
+
+def measure_speedup(discount, learning_rate, threshold, max_iterations, environment, epsilon, worker_counts, seed=None, telemetry=None):
+    """
+    Times HogwildQLearning to threshold for each worker count, relative to the first count
+    :param discount: Float
+    :param learning_rate: Float
+    :param threshold: Float
+    :param max_iterations: Int
+    :param environment: RaceTrack
+    :param epsilon: Float
+    :param worker_counts: List, e.g. [1, 2, 4]
+    :param seed: Int
+    :param telemetry: Telemetry that each row is logged to
+    :return: List of Dicts with worker count, seconds, episodes, speedup and whether threshold was reached
+    """
+    telemetry = Telemetry() if telemetry is None else telemetry
+    environment.compile()
+    report = []
+    for num_workers in worker_counts:
+        agent = Car((0, 0), epsilon)
+        learner = HogwildQLearning(discount, learning_rate, threshold, max_iterations, environment, agent,
+                                   num_workers=num_workers, seed=seed, telemetry=Telemetry(QUIET))
+        start = time.perf_counter()
+        learner.run()
+        seconds = time.perf_counter() - start
+        avg_costs = learner.avg_costs
+        report.append({'workers': num_workers, 'seconds': seconds, 'episodes': learner.num_episodes,
+                       'speedup': report[0]['seconds'] / seconds if report else 1.0,
+                       'converged': bool(avg_costs) and avg_costs[-1] <= threshold})
+    for row in report:
+        telemetry.log(EPISODE, "Workers: ", row['workers'], "Seconds: ", round(row['seconds'], 4), "Episodes: ", row['episodes'],
+                      "Speedup: ", round(row['speedup'], 2), "Converged: ", row['converged'])
+    return report
@@ -0,0 +1,107 @@
+import numpy as np
+from racetrack import RaceTrack
+from telemetry import Telemetry, EPISODE
+from track_compiler import CompiledTrack
+from value_iteration import ValueIteration
+
+
+def diff_layouts(old_track, new_track):
+    """
+    Returns cells whose symbol class (wall, finish or open) differs between two compiled tracks of the same size
+    :param old_track: CompiledTrack
+    :param new_track: CompiledTrack
+    :return: Array of shape (N, 2) of (x, y) positions
+    """
+    if old_track.wall_mask.shape != new_track.wall_mask.shape:
+        raise ValueError("Layout edits must keep the track size")
+    changed = (old_track.wall_mask != new_track.wall_mask) | (old_track.finish_mask != new_track.finish_mask)
+    return np.argwhere(changed)[:, ::-1]
+
+def changed_states(old_table, new_table):
+    """
+    Maps states of old_table onto new_table by (x, y, vx, vy) and finds the states of new_table whose model differs:
+    new states, and states whose reward or any successor changed
+    :param old_table: TransitionTable
+    :param new_table: TransitionTable
+    :return: Tuple of the old id of every new state (-1 if new) and the Array of changed new state ids
+    """
+    old_states = old_table.decode_many(np.arange(old_table.num_states))
+    on_track = new_table.cell_index[old_states[:, 1], old_states[:, 0]] >= 0
+    old_to_new = np.full(old_table.num_states, -1, dtype=np.int64)
+    old_to_new[on_track] = new_table.encode_many(old_states[on_track])
+    new_to_old = np.full(new_table.num_states, -1, dtype=np.int64)
+    kept = old_to_new >= 0
+    new_to_old[old_to_new[kept]] = np.flatnonzero(kept)
+
+    changed = new_to_old < 0
+    shared = np.flatnonzero(~changed)
+    old_ids = new_to_old[shared]
+    changed[shared] |= old_table.terminal[old_ids] != new_table.terminal[shared]
+    changed[shared] |= (old_to_new[old_table.next_success[old_ids]] != new_table.next_success[shared]).any(axis=1)
+    changed[shared] |= old_to_new[old_table.next_fail[old_ids, 0]] != new_table.next_fail[shared, 0]
+    return new_to_old, np.flatnonzero(changed)
+
+class IncrementalPlanner:
+    """
+    Class for re-planning a track after small layout edits. Moves that cannot touch an edited cell are reused from the
+    previous transition table, and prioritized sweeping starts from the previous values with only the states whose
+    model changed, and their predecessors, on the queue
+    """
+    def __init__(self, discount, threshold, max_iterations, environment, agent, telemetry=None, block_size=4096):
+        """
+        Initializes planner
+        :param discount: Float
+        :param threshold: Float
+        :param max_iterations: Int
+        :param environment: RaceTrack, the track before any edit
+        :param agent: Car
+        :param telemetry: Telemetry
+        :param block_size: Int, states backed up together by prioritized sweeping
+        """
+        self.discount = discount
+        self.threshold = threshold
+        self.max_iterations = max_iterations
+        self.environment = environment
+        self.agent = agent
+        self.telemetry = Telemetry() if telemetry is None else telemetry
+        self.block_size = block_size
+        self.value_function = None
+        self.num_backups = 0
+
+    def solve(self):
+        """
+        Solves the current track from zeros
+        :return: ValueTable
+        """
+        value_iterator = ValueIteration(self.discount, self.threshold, self.max_iterations, self.environment, self.agent,
+                                        engine='vectorized', telemetry=self.telemetry)
+        self.value_function = value_iterator.run()
+        self.num_backups = value_iterator.num_backups
+        return self.value_function
+
+    def update(self, layout):
+        """
+        Re-plans after the layout is edited; the track size, start and crash rule stay the same
+        :param layout: List
+        :return: ValueTable
+        """
+        if self.value_function is None:
+            self.solve()
+        old_environment = self.environment
+        old_table = old_environment.compile()
+        track = CompiledTrack(old_environment.num_rows, old_environment.num_cols, layout)
+        self.telemetry.log(EPISODE, "Changed cells: ", len(diff_layouts(old_environment.track, track)))
+        environment = RaceTrack(old_environment.num_rows, old_environment.num_cols, layout, old_environment.initial_state,
+                                reset_on_crash=old_environment.reset_on_crash, random_source=old_environment.random_source, track=track)
+        table = environment.compile(previous=old_table)
+
+        new_to_old, changed = changed_states(old_table, table)
+        self.telemetry.log(EPISODE, "Changed states: ", len(changed))
+        values = np.where(new_to_old >= 0, self.value_function.array[new_to_old], 0.0)
+        value_iterator = ValueIteration(self.discount, self.threshold, self.max_iterations, environment, self.agent,
+                                        engine='vectorized', update='prioritized', block_size=self.block_size, telemetry=self.telemetry,
+                                        initial_values=values, changed_states=changed)
+        self.value_function = value_iterator.run()
+        self.num_backups = value_iterator.num_backups
+        self.environment = environment
+        return self.value_function
@@ -1,17 +1,31 @@
 from car import Car
 from racetrack import RaceTrack
 from value_iteration import ValueIteration
+from policy_iteration import PolicyIteration
 from q_learning import QLearning
+from hogwild_q_learning import HogwildQLearning
 from sarsa import Sarsa
+from random_source import RandomSource
+from vector_racetrack import VectorRaceTrack
+from telemetry import Telemetry, EPISODE
+from checkpoint import load_checkpoint
+from track_compiler import compile_track
+from policy import compile_policy, evaluate_policy
+from path_queries import PathQueryService, start_states
 
 
 def draw_track(path, track):
     """
-    Draws track from given path
-    :param path: List
+    Draws track from given path, or each route of a batched PathQueryService result on its own copy of the track
+    :param path: List of states, or List of Dicts from PathQueryService.query
     :param track: List
     :return: None
     """
+    if path and isinstance(path[0], dict):
+        for result in path:
+            print("Start: ", result['start'], "Expected cost: ", round(result['cost_to_go'], 4), "Truncated: ", result['truncated'])
+            draw_track(result['path'], list(track))
+        return
     print("Cost: ", len(path))
     for step in path:
         old_line = track[step[1]]
@@ -20,10 +34,27 @@ def draw_track(path, track):
     for line in track:
         print(line)
 
-def main(algorithm, track, x_start, y_start, discount, learning_rate, threshold, max_iterations, epsilon=None, reset_on_crash=False):
+def read_track(track):
+    """
+    Reads track file
+    :param track: String, path to track file
+    :return: Tuple of rows, columns and layout
+    """
+    with open(track) as f:
+        specs = f.readline().strip().split(',')
+        rows = int(specs[0])
+        cols = int(specs[1])
+        layout = f.read().splitlines()
+    return rows, cols, layout
+
+def main(algorithm, track, x_start, y_start, discount, learning_rate, threshold, max_iterations, epsilon=None, reset_on_crash=False, seed=None, num_cars=None,
+         verbosity=EPISODE, telemetry_path=None, engine='python', reachable_only=False,
+         checkpoint_path=None, checkpoint_every=None, warm_start=None, evaluation_episodes=None, planning_steps=0,
+         trace_decay=0.0, replacing_traces=False, backend='python', multigrid_levels=0,
+         num_workers=None, all_starts=False):
     """
     Program entry. Runs selected algorithm on selected track, at given coordinates, with given parameters
-    :param algorithm: String
+    :param algorithm: String, 'value_iteration', 'policy_iteration', 'q_learning' or 'sarsa'
     :param track: List
     :param x_start: Int
     :param y_start: Int
@@ -33,42 +64,107 @@ def main(algorithm, track, x_start, y_start, discount, learning_rate, threshold,
     :param max_iterations: Int
     :param epsilon: Float
     :param reset_on_crash: Boolean
+    :param seed: Int, seeds exploration and transition draws for reproducible runs
+    :param num_cars: Int, trains q_learning on this many cars at once when given
+    :param verbosity: Int, telemetry.QUIET, EPISODE or STEP
+    :param telemetry_path: String, CSV or JSON lines file that training metrics are flushed to
+    :param engine: String, value iteration engine: 'python' or 'vectorized'
+    :param reachable_only: Boolean, plan and learn over states reachable from the start only
+    :param checkpoint_path: String, value function or q table is checkpointed here at the end of the run, also an interrupted one
+    :param checkpoint_every: Int, also checkpoint every this many sweeps, policy improvements or episodes
+    :param warm_start: String, checkpoint to start from instead of zeros; may come from a slightly different track. Only its
+    values are used: this is a warm start, not a resume, so episode count, learning rate and epsilon start afresh
+    :param evaluation_episodes: Int, rolls out the learned greedy policy this many times and reports its cost distribution
+    :param planning_steps: Int, Dyna-style model backups per real step for q_learning
+    :param trace_decay: Float, lambda of the eligibility traces of q_learning and sarsa; 0 keeps one-step backups
+    :param replacing_traces: Boolean, replacing instead of accumulating eligibility traces
+    :param backend: String, 'python' or 'kernel'; 'kernel' runs q_learning and sarsa episodes in a JIT-compiled kernel when
+    Numba is installed, with identical results under a fixed seed
+    :param multigrid_levels: Int, vectorized value_iteration starts from the solution of a track coarsened this many times
+    :param num_workers: Int, trains q_learning with this many Hogwild worker processes sharing one q table when given
+    :param all_starts: Boolean, value_iteration and policy_iteration also draw the greedy route from every start cell
     :return: None
     """
-    with open(track) as f:
-        specs = f.readline().strip().split(',')
-        rows = int(specs[0])
-        cols = int(specs[1])
-        layout = f.read().splitlines()
+    compiled_track = compile_track(track)
+    rows, cols, layout = compiled_track.num_rows, compiled_track.num_cols, list(compiled_track.layout)
 
-        initial_state = (x_start, y_start, 0, 0)
-        initial_action = (0, 0)
+    initial_state = (x_start, y_start, 0, 0)
+    initial_action = (0, 0)
 
-        agent = Car(initial_action, epsilon)
-        environment = RaceTrack(rows, cols, layout, initial_state, reset_on_crash=reset_on_crash)
+    random_source = RandomSource(seed)
+    telemetry = Telemetry(verbosity, path=telemetry_path)
+    agent = Car(initial_action, epsilon, random_source=random_source)
+    environment = RaceTrack(rows, cols, layout, initial_state, reset_on_crash=reset_on_crash, random_source=random_source,
+                            track=compiled_track)
+    if reachable_only:
+        environment.compile(reachable_only=True)
+    initial_values = None
+    if warm_start is not None:
+        checkpoint = load_checkpoint(warm_start)
+        kind = 'value' if algorithm in ('value_iteration', 'policy_iteration') else 'q'
+        if algorithm in ('value_iteration', 'policy_iteration', 'q_learning', 'sarsa') and checkpoint.kind != kind:
+            raise ValueError("{} needs a '{}' checkpoint to warm start from, but {} holds a '{}' checkpoint".format(
+                algorithm, kind, warm_start, checkpoint.kind))
+        initial_values = checkpoint.values_for(environment.compile())
 
-        if algorithm == 'value_iteration':
-            value_iterator = ValueIteration(discount, threshold, max_iterations, environment, agent)
-            value_iterator.run()
-            path = value_iterator.extract_policy(initial_state)
-            value_iterator.plot_max_diffs()
-        elif algorithm == 'q_learning':
-            q_learner = QLearning(discount, learning_rate, threshold, max_iterations, environment, agent)
-            path = q_learner.run()
-            q_learner.plot_avg_cost()
-        elif algorithm == 'sarsa':
-            sarsa = Sarsa(discount, learning_rate, threshold, max_iterations, environment, agent)
-            path = sarsa.run()
-            sarsa.plot_avg_cost()
+    if algorithm in ('value_iteration', 'policy_iteration'):
+        if algorithm == 'policy_iteration':
+            value_iterator = PolicyIteration(discount, threshold, max_iterations, environment, agent, telemetry=telemetry,
+                                             initial_values=initial_values, checkpoint_path=checkpoint_path,
+                                             checkpoint_every=checkpoint_every)
+        else:
+            value_iterator = ValueIteration(discount, threshold, max_iterations, environment, agent, engine=engine, telemetry=telemetry,
+                                            initial_values=initial_values, checkpoint_path=checkpoint_path, checkpoint_every=checkpoint_every,
+                                            multigrid_levels=multigrid_levels)
+        value_iterator.run()
+        path = value_iterator.extract_policy(initial_state)
+        value_iterator.plot_max_diffs()
+        policy = value_iterator.compile_policy()
+        if all_starts:
+            service = PathQueryService(environment.compile(), value_iterator.value_array(), discount=discount, policy=policy)
+            draw_track(service.query(start_states(compiled_track)), layout)
+    elif algorithm == 'q_learning':
+        if num_workers:
+            if num_cars or planning_steps or trace_decay:
+                raise ValueError("Hogwild workers run one-step updates on one car each; num_workers cannot be combined with "
+                                 "num_cars, planning_steps or trace_decay")
+            q_learner = HogwildQLearning(discount, learning_rate, threshold, max_iterations, environment, agent, num_workers=num_workers,
+                                         seed=seed, telemetry=telemetry, initial_q=initial_values, checkpoint_path=checkpoint_path,
+                                         checkpoint_every=checkpoint_every)
         else:
-            print("No algorithm selected")
-            return None
-        draw_track(path, layout)
+            q_learner = QLearning(discount, learning_rate, threshold, max_iterations, environment, agent, telemetry=telemetry,
+                                  initial_q=initial_values, checkpoint_path=checkpoint_path, checkpoint_every=checkpoint_every,
+                                  planning_steps=planning_steps, trace_decay=trace_decay, replacing_traces=replacing_traces,
+                                  backend=backend)
+        if num_cars:
+            cars = VectorRaceTrack(rows, cols, layout, initial_state, num_cars, reset_on_crash=reset_on_crash, random_source=random_source,
+                                   track=compiled_track)
+            path = q_learner.run_batched(cars)
+        else:
+            path = q_learner.run()
+        q_learner.plot_avg_cost()
+        policy = compile_policy(q_learner.q_function.transition_table, q_values=q_learner.q_function.array)
+    elif algorithm == 'sarsa':
+        sarsa = Sarsa(discount, learning_rate, threshold, max_iterations, environment, agent, telemetry=telemetry,
+                      initial_q=initial_values, checkpoint_path=checkpoint_path, checkpoint_every=checkpoint_every,
+                      trace_decay=trace_decay, replacing_traces=replacing_traces, backend=backend)
+        path = sarsa.run()
+        sarsa.plot_avg_cost()
+        policy = compile_policy(sarsa.q_function.transition_table, q_values=sarsa.q_function.array)
+    else:
+        print("No algorithm selected")
+        return None
+    draw_track(path, layout)
+    if evaluation_episodes:
+        report = evaluate_policy(environment.compile(), policy, initial_state, evaluation_episodes, random_source=random_source)
+        print("Mean cost: ", report['mean'], "Variance: ", report['variance'], "Quantiles: ", report['quantiles'],
+              "Truncated: ", report['truncated'])
 
 
-# O-track: (2, 10)
-# L-track: (1, 8)
-# R-track: (2, 26)
-main('value_iteration', 'R-track.txt', x_start=2, y_start=26, discount=0.9, learning_rate=0.9, threshold=0.0001, max_iterations=10000, reset_on_crash=False)
-# main('sarsa', 'L-track.txt', x_start=1, y_start=8, discount=0.9, learning_rate=0.9, threshold=30, max_iterations=10000, epsilon=0.5, reset_on_crash=False)
-# main('q_learning', 'O-track.txt', x_start=2, y_start=10, discount=0.9, learning_rate=0.9, threshold=30, max_iterations=10000, epsilon=0.5, reset_on_crash=False)
\ No newline at end of file
+if __name__ == '__main__':
+    # O-track: (2, 10)
+    # L-track: (1, 8)
+    # R-track: (2, 26)
+    main('value_iteration', 'R-track.txt', x_start=2, y_start=26, discount=0.9, learning_rate=0.9, threshold=0.0001, max_iterations=10000, reset_on_crash=False)
+    # main('sarsa', 'L-track.txt', x_start=1, y_start=8, discount=0.9, learning_rate=0.9, threshold=30, max_iterations=10000, epsilon=0.5, reset_on_crash=False)
+    # main('q_learning', 'O-track.txt', x_start=2, y_start=10, discount=0.9, learning_rate=0.9, threshold=30, max_iterations=10000, epsilon=0.5, reset_on_crash=False)
\ No newline at end of file
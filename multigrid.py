@@ -0,0 +1,63 @@
+import numpy as np
+from racetrack import X_VEL_LO_LIM, X_VEL_UP_LIM, Y_VEL_LO_LIM, Y_VEL_UP_LIM
+
+
+def coarsen_track(num_rows, num_cols, layout, factor=2):
+    """
+    Downsamples layout by merging factor x factor blocks of cells. A block is a finish cell if any of its cells is,
+    a wall only if all of its cells are, and a start cell if any of its cells is, so corridors stay open
+    :param num_rows: Int
+    :param num_cols: Int
+    :param layout: List
+    :param factor: Int
+    :return: Tuple of rows, columns and layout
+    """
+    coarse_rows = -(-num_rows // factor)
+    coarse_cols = -(-num_cols // factor)
+    coarse_layout = []
+    for y in range(coarse_rows):
+        line = []
+        for x in range(coarse_cols):
+            block = [layout[fine_y][fine_x] for fine_y in range(y * factor, min((y + 1) * factor, num_rows))
+                     for fine_x in range(x * factor, min((x + 1) * factor, num_cols))]
+            if 'F' in block:
+                line.append('F')
+            elif all(symbol == '#' for symbol in block):
+                line.append('#')
+            elif 'S' in block:
+                line.append('S')
+            else:
+                line.append('.')
+        coarse_layout.append(''.join(line))
+    return coarse_rows, coarse_cols, coarse_layout
+
+def prolongate(coarse_table, coarse_values, fine_table, factor=2):
+    """
+    Interpolates values of a track coarsened by factor onto the fine state space. Positions map to their block;
+    a fine velocity v corresponds to the coarse velocity v / factor, interpolated bilinearly between the
+    neighbouring coarse velocities. A coarse step covers about as many fine cells as a fine step, so values
+    transfer without rescaling
+    :param coarse_table: TransitionTable, full (not reachable-only) table of the coarse track
+    :param coarse_values: Array
+    :param fine_table: TransitionTable
+    :param factor: Int
+    :return: Array
+    """
+    states = fine_table.decode_many(np.arange(fine_table.num_states))
+    x_velocities = np.clip(states[:, 2] / factor, X_VEL_LO_LIM, X_VEL_UP_LIM)
+    y_velocities = np.clip(states[:, 3] / factor, Y_VEL_LO_LIM, Y_VEL_UP_LIM)
+    coarse_states = np.empty_like(states)
+    coarse_states[:, 0] = states[:, 0] // factor
+    coarse_states[:, 1] = states[:, 1] // factor
+    values = np.zeros(fine_table.num_states)
+    x_low = np.floor(x_velocities).astype(np.int64)
+    y_low = np.floor(y_velocities).astype(np.int64)
+    for x_corner in (0, 1):
+        x_weights = 1 - np.abs(x_velocities - (x_low + x_corner))
+        for y_corner in (0, 1):
+            y_weights = 1 - np.abs(y_velocities - (y_low + y_corner))
+            weights = np.clip(x_weights, 0, 1) * np.clip(y_weights, 0, 1)
+            coarse_states[:, 2] = np.minimum(x_low + x_corner, X_VEL_UP_LIM)
+            coarse_states[:, 3] = np.minimum(y_low + y_corner, Y_VEL_UP_LIM)
+            values += weights * coarse_values[coarse_table.encode_many(coarse_states)]
+    return values
@@ -0,0 +1,141 @@
+import time
+import numpy as np
+from multiprocessing import Pool, shared_memory
+from tables import ValueTable
+from telemetry import Telemetry, QUIET, EPISODE
+from value_iteration import ValueIteration, bellman_backup
+
+
+# Arrays attached by each worker process, keyed by name
+_shared_arrays = {}
+_shared_blocks = []
+
+def _attach(specs, discount, success_prob, fail_prob):
+    """
+    Worker initializer: attaches the shared transition and value arrays
+    :param specs: Dict mapping array names to (shared memory name, shape, dtype)
+    :param discount: Float
+    :param success_prob: Float
+    :param fail_prob: Float
+    :return: None
+    """
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        _shared_blocks.append(block)
+        _shared_arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    _shared_arrays['parameters'] = (discount, success_prob, fail_prob)
+
+def _sweep_partition(task):
+    """
+    Backs up one partition of states from one value buffer into the other
+    :param task: Tuple of start, stop and source buffer index
+    :return: Float, maximum difference within the partition
+    """
+    start, stop, source = task
+    discount, success_prob, fail_prob = _shared_arrays['parameters']
+    values = _shared_arrays['values'][source]
+    new_values = bellman_backup(values, _shared_arrays['reward'][start:stop], _shared_arrays['next_success'][start:stop],
+                                _shared_arrays['next_fail'][start:stop], discount, success_prob, fail_prob)
+    _shared_arrays['values'][1 - source, start:stop] = new_values
+    return np.max(new_values - values[start:stop])
+
+class ParallelValueIteration(ValueIteration):
+    """
+    Class that implements synchronous Value Iteration over state partitions on a pool of worker processes
+    """
+    def __init__(self, discount, threshold, max_iterations, environment, agent, num_workers=2, num_partitions=None, telemetry=None):
+        """
+        Initializes algorithm
+        :param discount: Float
+        :param threshold: Float
+        :param max_iterations: Int
+        :param environment: RaceTrack
+        :param agent: Car
+        :param num_workers: Int
+        :param num_partitions: Int, contiguous state ranges per sweep; defaults to num_workers
+        :param telemetry: Telemetry
+        """
+        super().__init__(discount, threshold, max_iterations, environment, agent, engine='vectorized', telemetry=telemetry)
+        self.num_workers = num_workers
+        self.num_partitions = num_partitions if num_partitions is not None else num_workers
+
+    def run(self):
+        """
+        Runs algorithm
+        :return: ValueTable
+        """
+        self.transition_table = self.environment.compile()
+        self.all_actions = self.agent.get_all_actions()
+        table = self.transition_table
+        num_states = table.num_states
+
+        # Transition arrays and both value buffers live in shared memory; sweeps alternate between buffers
+        arrays = {
+            'reward': table.reward,
+            'next_success': table.next_success,
+            'next_fail': np.ascontiguousarray(table.next_fail),
+            'values': np.zeros((2, num_states)),
+        }
+        blocks = {}
+        specs = {}
+        try:
+            for name, array in arrays.items():
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                blocks[name] = block
+                np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+                specs[name] = (block.name, array.shape, array.dtype)
+            values = np.ndarray((2, num_states), dtype=np.float64, buffer=blocks['values'].buf)
+
+            bounds = np.linspace(0, num_states, self.num_partitions + 1).astype(int)
+            source = 0
+            max_difference = np.inf
+            i = 0
+            with Pool(self.num_workers, initializer=_attach, initargs=(specs, self.discount, table.success_prob, table.fail_prob)) as pool:
+                while i < self.max_iterations and max_difference > self.threshold:
+                    tasks = [(bounds[p], bounds[p + 1], source) for p in range(self.num_partitions) if bounds[p] < bounds[p + 1]]
+                    max_difference = max(pool.map(_sweep_partition, tasks))
+                    source = 1 - source
+                    self.telemetry.log(EPISODE, "Maximum difference: ", max_difference)
+                    self.telemetry.record('max_diff', max_difference)
+                    self.num_backups += num_states
+                    i += 1
+                    self.telemetry.log(EPISODE, "Iterations: ", i)
+            self.value_function = ValueTable(table, values[source].copy())
+            self.telemetry.flush()
+        finally:
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+        return self.value_function
+
+def measure_speedup(discount, threshold, max_iterations, environment, agent, worker_counts, telemetry=None):
+    """
+    Times serial vectorized Value Iteration against ParallelValueIteration for each worker count
+    :param discount: Float
+    :param threshold: Float
+    :param max_iterations: Int
+    :param environment: RaceTrack
+    :param agent: Car
+    :param worker_counts: List
+    :param telemetry: Telemetry that each row is logged to
+    :return: List of Dicts with worker count, seconds, speedup and whether values matched the serial result
+    """
+    telemetry = Telemetry() if telemetry is None else telemetry
+    environment.compile()
+    start = time.perf_counter()
+    serial = ValueIteration(discount, threshold, max_iterations, environment, agent, engine='vectorized', telemetry=Telemetry(QUIET))
+    serial_values = serial.run().array
+    serial_seconds = time.perf_counter() - start
+    report = [{'workers': 0, 'seconds': serial_seconds, 'speedup': 1.0, 'identical': True}]
+    for num_workers in worker_counts:
+        start = time.perf_counter()
+        parallel = ParallelValueIteration(discount, threshold, max_iterations, environment, agent, num_workers=num_workers,
+                                          telemetry=Telemetry(QUIET))
+        parallel_values = parallel.run().array
+        seconds = time.perf_counter() - start
+        report.append({'workers': num_workers, 'seconds': seconds, 'speedup': serial_seconds / seconds,
+                       'identical': bool(np.array_equal(serial_values, parallel_values))})
+    for row in report:
+        telemetry.log(EPISODE, "Workers: ", row['workers'] or 'serial', "Seconds: ", round(row['seconds'], 4), "Speedup: ",
+                      round(row['speedup'], 2), "Identical: ", row['identical'])
+    return report
@@ -0,0 +1,100 @@
+import numpy as np
+from collections import OrderedDict
+from policy import compile_policy
+
+
+def start_states(track):
+    """
+    Returns standing start state of every start cell
+    :param track: CompiledTrack
+    :return: List of Tuples
+    """
+    return [(x, y, 0, 0) for x, y in track.start_cells.tolist()]
+
+class PathQueryService:
+    """
+    Class for answering batches of route queries against a solved value table. Routes follow the greedy policy along
+    intended (successful) moves, so they are deterministic, and an LRU cache of route suffixes lets routes that merge
+    into an earlier one stop there
+    """
+    def __init__(self, transition_table, values, discount=0.9, policy=None, cache_size=65536, max_steps=1000):
+        """
+        Initializes service
+        :param transition_table: TransitionTable
+        :param values: Array of state values in transition table order
+        :param discount: Float
+        :param policy: Array of action ids from compile_policy; compiled from values if None
+        :param cache_size: Int, route suffixes held
+        :param max_steps: Int, routes that have not finished after this many moves are truncated
+        """
+        self.transition_table = transition_table
+        self.values = values
+        self.policy = compile_policy(transition_table, values, discount=discount) if policy is None else policy
+        self.cache_size = cache_size
+        self.max_steps = max_steps
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def query(self, states):
+        """
+        Answers route queries for a batch of states; all routes advance together one move per step
+        :param states: List of Tuples
+        :return: List of Dicts with start state, path of states, expected (discounted) cost to go and whether the path
+        was truncated
+        """
+        table = self.transition_table
+        state_ids = table.encode_many(np.array(states, dtype=np.int64).reshape(-1, 4))
+        if np.any(state_ids < 0):
+            raise ValueError("Queried states must be in the transition table")
+        routes = [[state_id] for state_id in state_ids.tolist()]
+        suffixes = [None] * len(routes)
+        current = state_ids.astype(np.int64)
+        active = np.arange(len(routes))
+        for _ in range(self.max_steps + 1):
+            # Routes stop at the finish or where a cached route continues
+            still_active = []
+            for route, state_id in zip(active.tolist(), current.tolist()):
+                suffix = self.cache.get(state_id)
+                if suffix is not None:
+                    self.cache.move_to_end(state_id)
+                    suffixes[route] = suffix
+                    routes[route].pop()
+                elif not table.terminal[state_id]:
+                    still_active.append(route)
+            keep = np.isin(active, still_active)
+            active, current = active[keep], current[keep]
+            if not len(active) or len(routes[active[0]]) > self.max_steps:
+                break
+            current = table.next_success[current, self.policy[current]].astype(np.int64)
+            for route, state_id in zip(active.tolist(), current.tolist()):
+                routes[route].append(state_id)
+
+        results = []
+        truncated_routes = set(active.tolist())
+        for route, state_id in enumerate(state_ids.tolist()):
+            truncated = route in truncated_routes
+            path = np.array(routes[route], dtype=np.int64)
+            if suffixes[route] is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                path = np.concatenate((path, suffixes[route]))
+            if not truncated:
+                self.__remember(path, len(routes[route]))
+            results.append({'start': tuple(states[route]), 'path': [tuple(state) for state in table.decode_many(path).tolist()],
+                            'cost_to_go': float(self.values[state_id]), 'truncated': truncated})
+        return results
+
+    def __remember(self, path, num_walked):
+        """
+        Caches the suffix of a finished route from every newly walked state; suffixes are views of one array
+        :param path: Array of state ids
+        :param num_walked: Int, leading states of path that were walked rather than taken from the cache
+        :return: None
+        """
+        for i, state_id in enumerate(path[:num_walked].tolist()):
+            self.cache[state_id] = path[i:]
+            self.cache.move_to_end(state_id)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
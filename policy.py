@@ -0,0 +1,84 @@
+import numpy as np
+from random_source import RandomSource
+
+
+# Percentiles reported by evaluate_policy
+QUANTILES = (5, 25, 50, 75, 95)
+
+def action_values(transition_table, values, discount):
+    """
+    Computes expected one-step backup of every state-action pair
+    :param transition_table: TransitionTable
+    :param values: Array of shape (num_states,)
+    :param discount: Float
+    :return: Array of shape (num_states, num_actions)
+    """
+    table = transition_table
+    values = np.asarray(values)
+    q_values = table.reward[:, None] + discount * table.success_prob * values[table.next_success]
+    q_values += discount * table.fail_prob * values[table.next_fail]
+    return q_values
+
+def compile_policy(transition_table, values=None, q_values=None, discount=0.9):
+    """
+    Turns a value function or q table into the greedy action id of every state
+    :param transition_table: TransitionTable
+    :param values: Array of shape (num_states,); greedy with respect to the expected one-step backup
+    :param q_values: Array of shape (num_states, num_actions); used instead of values when given
+    :param discount: Float
+    :return: Array of int8 action ids
+    """
+    if q_values is None:
+        q_values = action_values(transition_table, values, discount)
+    return np.argmin(np.asarray(q_values), axis=1).astype(np.int8)
+
+def evaluate_policy(transition_table, policy, initial_states, num_episodes=10000, max_steps=10000, random_source=None):
+    """
+    Rolls out a compiled policy for many episodes at once and summarizes their costs. Cost is the length of the
+    path, counting the initial state, as reported for the learners and by draw_track
+    :param transition_table: TransitionTable
+    :param policy: Array of action ids
+    :param initial_states: Tuple state, List or Array of state tuples, or List or Array of state ids; episodes start
+    from these in turn
+    :param num_episodes: Int
+    :param max_steps: Int, episodes still running after this many steps are truncated
+    :param random_source: RandomSource
+    :return: Dict with mean, variance, std, min, max, quantiles, truncated count and costs
+    """
+    table = transition_table
+    random_source = RandomSource() if random_source is None else random_source
+    states = np.asarray(initial_states)
+    if not np.issubdtype(states.dtype, np.integer):
+        raise ValueError("Initial states must be integer state tuples or state ids")
+    if isinstance(initial_states, tuple) and states.ndim == 1:
+        states = states[None]
+    if states.ndim == 2:
+        on_track = table.cell_index[states[:, 1], states[:, 0]] >= 0
+        start_ids = np.full(len(states), -1, dtype=np.int64)
+        start_ids[on_track] = table.encode_many(states[on_track])
+    else:
+        start_ids = np.atleast_1d(states).astype(np.int64)
+    if np.any(start_ids < 0) or np.any(start_ids >= table.num_states):
+        raise ValueError("Initial states must be in the transition table")
+    state_ids = start_ids[np.arange(num_episodes) % len(start_ids)]
+    costs = np.ones(num_episodes, dtype=np.int64)
+    running = np.flatnonzero(~table.terminal[state_ids])
+    for _ in range(max_steps):
+        if not len(running):
+            break
+        current = state_ids[running]
+        actions = policy[current]
+        success = random_source.uniforms(len(running)) < table.success_prob
+        state_ids[running] = np.where(success, table.next_success[current, actions], table.next_fail[current, actions])
+        costs[running] += 1
+        running = running[~table.terminal[state_ids[running]]]
+    return {
+        'mean': float(costs.mean()),
+        'variance': float(costs.var()),
+        'std': float(costs.std()),
+        'min': int(costs.min()),
+        'max': int(costs.max()),
+        'quantiles': {q: float(v) for (q, v) in zip(QUANTILES, np.percentile(costs, QUANTILES))},
+        'truncated': int(len(running)),
+        'costs': costs,
+    }
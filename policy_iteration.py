@@ -0,0 +1,122 @@
+import numpy as np
+from scipy import sparse
+from scipy.sparse import linalg
+from tables import ValueTable
+from policy import action_values
+from telemetry import EPISODE
+from value_iteration import ValueIteration
+
+
+class PolicyIteration(ValueIteration):
+    """
+    Class that implements the Policy Iteration algorithm, evaluating each policy with a sparse linear solve
+    """
+    def __init__(self, discount, threshold, max_iterations, environment, agent, solver='iterative', telemetry=None, initial_values=None,
+                 checkpoint_path=None, checkpoint_every=None):
+        """
+        Initializes algorithm
+        :param discount: Float
+        :param threshold: Float, an action is only replaced when another improves its expected backup by more than this
+        :param max_iterations: Int, maximum number of policy improvements
+        :param environment: RaceTrack
+        :param agent: Car
+        :param solver: String, 'direct' (sparse LU) or 'iterative' (BiCGSTAB warm-started from the previous values)
+        :param telemetry: Telemetry
+        :param initial_values: Array in transition table order; the first policy is greedy with respect to it
+        :param checkpoint_path: String, value function is checkpointed here at the end of the run, also an interrupted one
+        :param checkpoint_every: Int, also checkpoint every this many policy improvements
+        """
+        super().__init__(discount, threshold, max_iterations, environment, agent, engine='vectorized', telemetry=telemetry,
+                         initial_values=initial_values, checkpoint_path=checkpoint_path,
+                         checkpoint_every=checkpoint_every)
+        self.solver = solver
+        self.policy = None
+
+    def run(self):
+        """
+        Runs algorithm
+        :return: ValueTable
+        """
+        self.transition_table = self.environment.compile()
+        self.all_actions = self.agent.get_all_actions()
+        table = self.transition_table
+        values = np.zeros(table.num_states) if self.initial_values is None else np.array(self.initial_values, dtype=np.float64)
+        policy = np.argmin(action_values(table, values, self.discount), axis=1).astype(np.int8)
+        num_changed = len(policy)
+        i = 0
+        try:
+            while i < self.max_iterations and num_changed > 0:
+                new_values = self.evaluate(policy, values)
+                max_difference = np.max(new_values - values)
+                values = new_values
+                policy, num_changed = self.improve(policy, values)
+                self.telemetry.log(EPISODE, "Maximum difference: ", max_difference)
+                self.telemetry.log(EPISODE, "Policy changes: ", num_changed)
+                self.telemetry.record('max_diff', max_difference)
+                self.num_backups += len(values)
+                i += 1
+                self.telemetry.log(EPISODE, "Iterations: ", i)
+                if self.checkpoint_every and i % self.checkpoint_every == 0:
+                    self.save_checkpoint(values, i)
+        finally:
+            # An interrupted run still keeps the values of its last evaluated policy
+            self.save_checkpoint(values, i)
+        self.policy = policy
+        self.value_function = ValueTable(table, values)
+        self.telemetry.flush()
+        return self.value_function
+
+    def transition_matrix(self, policy):
+        """
+        Builds transition matrix of a fixed policy, with the success and failure successor of each state
+        :param policy: Array of action ids
+        :return: scipy.sparse.csr_matrix of shape (num_states, num_states)
+        """
+        table = self.transition_table
+        states = np.arange(table.num_states)
+        columns = np.stack((table.next_success[states, policy], table.next_fail[states, policy]), axis=1)
+        probabilities = np.tile((table.success_prob, table.fail_prob), (table.num_states, 1))
+        indptr = np.arange(0, 2 * table.num_states + 1, 2)
+        # Duplicate columns (failure leads where success does) are summed by the conversion
+        matrix = sparse.csr_matrix((probabilities.ravel(), columns.ravel(), indptr), shape=(table.num_states, table.num_states))
+        matrix.sum_duplicates()
+        return matrix
+
+    def evaluate(self, policy, values=None):
+        """
+        Solves (I - discount * P) V = reward for the value function of given policy
+        :param policy: Array of action ids
+        :param values: Array, starting guess for the iterative solver
+        :return: Array
+        """
+        table = self.transition_table
+        system = sparse.identity(table.num_states, format='csr') - self.discount * self.transition_matrix(policy)
+        if self.solver == 'iterative':
+            solution, info = linalg.bicgstab(system, table.reward, x0=values, rtol=0.0,
+                                             atol=self.threshold * (1 - self.discount))
+            if info != 0:
+                raise RuntimeError("Policy evaluation did not converge: {}".format(info))
+            return solution
+        return linalg.spsolve(system.tocsc(), table.reward)
+
+    def improve(self, policy, values):
+        """
+        Makes policy greedy with respect to given values, keeping current actions unless beaten by more than the threshold
+        :param policy: Array of action ids
+        :param values: Array
+        :return: Tuple of new policy and number of changed states
+        """
+        q_values = action_values(self.transition_table, values, self.discount)
+        greedy = np.argmin(q_values, axis=1)
+        states = np.arange(len(policy))
+        changed = q_values[states, policy] - q_values[states, greedy] > self.threshold
+        new_policy = policy.copy()
+        new_policy[changed] = greedy[changed]
+        return new_policy, int(np.count_nonzero(changed))
+
+    def compile_policy(self):
+        """
+        Returns policy found by the last run
+        :return: Array of int8 action ids
+        """
+        return self.policy
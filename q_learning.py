@@ -1,13 +1,21 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from collections import deque
+from eligibility_traces import EligibilityTraces
+from episode_kernel import EpisodeKernel
+from tables import QTable, state_index
+from dyna_model import DynaModel
+from checkpoint import save_checkpoint
+from telemetry import Telemetry, EPISODE, STEP
 
 
 class QLearning:
     """
     Class that implements Q-Learning algorithm
     """
-    def __init__(self, discount, learning_rate, threshold, max_iterations, environment, agent):
+    def __init__(self, discount, learning_rate, threshold, max_iterations, environment, agent, telemetry=None, initial_q=None,
+                 checkpoint_path=None, checkpoint_every=None, planning_steps=0,
+                 planning_batch=512, trace_decay=0.0, replacing_traces=False, backend='python', recorder=None):
         """
         Initializes class
         :param discount: Float
@@ -16,6 +24,18 @@ class QLearning:
         :param max_iterations: Int
         :param environment: RaceTrack
         :param agent: Car
+        :param telemetry: Telemetry
+        :param initial_q: Array of shape (num_states, num_actions) in transition table order to start from instead
+        of zeros, e.g. from Checkpoint.values_for
+        :param checkpoint_path: String, q table is checkpointed here at the end of the run, also an interrupted one
+        :param checkpoint_every: Int, also checkpoint every this many episodes
+        :param planning_steps: Int, Dyna-style backups from the learned model per real step; 0 disables planning
+        :param planning_batch: Int, backups owed by real steps are applied together once this many have accrued
+        :param trace_decay: Float, lambda of Watkins's Q(lambda); 0 keeps one-step backups
+        :param replacing_traces: Boolean, replacing instead of accumulating eligibility traces
+        :param backend: String, 'python' steps through Car and RaceTrack; 'kernel' runs whole episodes in an EpisodeKernel,
+        with identical results under a fixed seed
+        :param recorder: TrajectoryLog that every real transition is appended to, e.g. for FittedQIteration
         """
         self.discount = discount
         self.learning_rate = learning_rate
@@ -23,18 +43,54 @@ class QLearning:
         self.max_iterations = max_iterations
         self.environment = environment
         self.agent = agent
-        self.avg_costs = []
+        self.telemetry = Telemetry() if telemetry is None else telemetry
+        self.initial_q = initial_q
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.trace_decay = trace_decay
+        self.replacing_traces = replacing_traces
+        self.traces = None
+        self.backend = backend
+        self.kernel = None
+        self.planning_steps = planning_steps
+        self.planning_batch = max(planning_batch, planning_steps)
+        self.model = None
+        self.recorder = recorder
+
+    @property
+    def avg_costs(self):
+        """
+        Returns average cost over the last 25 episodes, recorded after every episode once 25 have run
+        :return: List
+        """
+        return self.telemetry.history('avg_cost')
 
     def __initialize_values(self):
         """
         Initializes q function
         :return: None
         """
-        self.all_states = self.environment.get_all_states()
         self.all_actions = self.agent.get_all_actions()
-        self.state_action_pairs = {(s, a) for s in self.all_states for a in self.all_actions}
-        self.q_function = {k: v for (k, v) in zip(self.state_action_pairs, np.zeros(len(self.state_action_pairs)))}
+        initial_q = None if self.initial_q is None else np.array(self.initial_q, dtype=np.float64)
+        self.q_function = QTable(self.environment.compile(), initial_q)
         self.agent.set_q_function(self.q_function)
+        if self.trace_decay:
+            self.traces = EligibilityTraces(self.q_function.array.size, replacing=self.replacing_traces)
+        if self.backend == 'kernel':
+            if self.trace_decay or self.planning_steps:
+                raise ValueError("The episode kernel only runs one-step updates")
+            if self.recorder is not None:
+                raise ValueError("The episode kernel does not record transitions")
+            if self.agent.random_source is not self.environment.random_source:
+                raise ValueError("The episode kernel needs the car and the track to share one random source")
+            self.kernel = EpisodeKernel(self.q_function, sarsa=False)
+        if self.recorder is not None:
+            table = self.q_function.transition_table
+            self.recorder.check_table(self.environment.track.table_key(table.reachable_only, self.environment.reset_on_crash,
+                                                                       self.environment.initial_state))
+        if self.planning_steps:
+            table = self.q_function.transition_table
+            self.model = DynaModel(table.num_states, table.num_actions)
 
     def run(self):
         """
@@ -47,35 +103,178 @@ class QLearning:
         i = 0
         num_iterations = 0
         path = []
-        while cost > self.threshold and i < self.max_iterations:
-            initial_state = self.environment.reset_state()
-            current_state = initial_state
-            path = [current_state]
-            while not self.environment.in_terminal_state():
-                current_action = self.agent.take_action(current_state)
-                next_state = self.environment.update_state(current_action, indicate_random=True)
-                reward = self.environment.get_reward(next_state)
-                next_action = self.agent.take_action(next_state)
-                current_q = self.q_function[(current_state, current_action)]
-                next_q = self.q_function[(next_state, next_action)]
-                self.q_function[(current_state, current_action)] += self.learning_rate * (reward + self.discount * next_q - current_q)
-                print(current_state, next_state, current_action, '\n')
-                current_state = next_state
-                path.append(current_state)
-            self.learning_rate -= 0.0001
-            self.learning_rate = max(self.learning_rate, 0.001)
-            q.appendleft(len(path))
-            if len(q) == 25:
-                cost = sum(q) / len(q)
-                print("Average cost: ", cost)
-                self.avg_costs.append(cost)
-                q.pop()
-            i += 1
-            num_iterations += 1
-            print("Iterations: ", num_iterations, '--------------------------------------------')
-        print("Finished training---------------------------------------")
+        pending_backups = 0
+        log_steps = self.telemetry.enabled(STEP)
+        try:
+            while cost > self.threshold and i < self.max_iterations:
+                self.telemetry.start_timer('episode_seconds')
+                initial_state = self.environment.reset_state()
+                current_state = initial_state
+                path = [current_state]
+                if self.kernel is not None:
+                    path = self.kernel.run_episode(initial_state, self.agent, self.learning_rate, self.discount,
+                                                   self.environment.random_source)
+                else:
+                    if self.traces is not None:
+                        self.traces.clear()
+                    while not self.environment.in_terminal_state():
+                        current_action = self.agent.take_action(current_state)
+                        next_state = self.environment.update_state(current_action, indicate_random=log_steps)
+                        reward = self.environment.get_reward(next_state)
+                        next_action = self.agent.take_action(next_state)
+                        current_q = self.q_function[(current_state, current_action)]
+                        next_q = self.q_function[(next_state, next_action)]
+                        if self.traces is None:
+                            self.q_function[(current_state, current_action)] += self.learning_rate * (reward + self.discount * next_q - current_q)
+                        else:
+                            self.__backup_traces(current_state, current_action, next_state, reward)
+                        if self.recorder is not None:
+                            self.__record(current_state, current_action, next_state, reward)
+                        if self.model is not None:
+                            state_id, action_id = self.q_function.index((current_state, current_action))
+                            self.model.record(state_id, action_id, state_index(self.q_function.transition_table, next_state), reward)
+                            pending_backups += self.planning_steps
+                            if pending_backups >= self.planning_batch:
+                                self.model.plan(self.q_function.array, pending_backups, self.discount, self.learning_rate,
+                                                self.environment.random_source)
+                                pending_backups = 0
+                        if log_steps:
+                            self.telemetry.log(STEP, current_state, next_state, current_action, '\n')
+                        current_state = next_state
+                        path.append(current_state)
+                self.learning_rate -= 0.0001
+                self.learning_rate = max(self.learning_rate, 0.001)
+                self.telemetry.stop_timer('episode_seconds')
+                self.telemetry.record('episode_cost', len(path))
+                self.telemetry.increment('steps', len(path) - 1)
+                q.appendleft(len(path))
+                if len(q) == 25:
+                    cost = sum(q) / len(q)
+                    self.telemetry.log(EPISODE, "Average cost: ", cost)
+                    self.telemetry.record('avg_cost', cost)
+                    q.pop()
+                i += 1
+                if self.checkpoint_every and i % self.checkpoint_every == 0:
+                    self.save_checkpoint(i)
+                num_iterations += 1
+                self.telemetry.log(EPISODE, "Iterations: ", num_iterations, '--------------------------------------------')
+        finally:
+            # Transitions logged and episodes finished before an error still reach disk
+            if self.recorder is not None:
+                self.recorder.flush()
+            self.save_checkpoint(i)
+        self.telemetry.log(EPISODE, "Finished training---------------------------------------")
+        self.telemetry.flush()
+        if self.kernel is not None:
+            path = self.kernel.decode_path(path, self.environment)
         return path
 
+    def __backup_traces(self, state, action, next_state, reward):
+        """
+        Applies Watkins's Q(lambda) backup along the eligibility traces; an exploratory action cuts the traces
+        :param state: Tuple
+        :param action: Tuple
+        :param next_state: Tuple
+        :param reward: Int
+        :return: None
+        """
+        state_id, action_id = self.q_function.index((state, action))
+        q_values = self.q_function.array
+        if q_values[state_id, action_id] > q_values[state_id].min():
+            self.traces.clear()
+        best_next_q = q_values[state_index(self.q_function.transition_table, next_state)].min()
+        self.traces.visit(state_id * len(self.all_actions) + action_id)
+        self.traces.apply(q_values.reshape(-1), self.learning_rate * (reward + self.discount * best_next_q - q_values[state_id, action_id]))
+        self.traces.decay(self.discount * self.trace_decay)
+
+    def __record(self, state, action, next_state, reward):
+        """
+        Appends transition to the recorder
+        :param state: Tuple
+        :param action: Tuple
+        :param next_state: Tuple
+        :param reward: Int
+        :return: None
+        """
+        table = self.q_function.transition_table
+        state_id, action_id = self.q_function.index((state, action))
+        next_id = state_index(table, next_state)
+        self.recorder.append(state_id, action_id, reward, next_id, table.terminal[next_id])
+
+    def run_batched(self, environment):
+        """
+        Runs algorithm on all cars of a VectorRaceTrack together, applying one batched update per step
+        :param environment: VectorRaceTrack
+        :return: List
+        """
+        self.__initialize_values()
+        table = self.q_function.transition_table
+        q_values = self.q_function.array
+        actions = np.array(table.actions)
+        q = deque(maxlen=25)
+        cost = np.inf
+        num_iterations = 0
+        states = environment.reset_state().copy()
+        path_lengths = np.ones(environment.num_cars, dtype=np.int64)
+        path = [tuple(int(v) for v in states[0])]
+        last_path = path
+        try:
+            while cost > self.threshold and num_iterations < self.max_iterations:
+                state_ids = table.encode_many(states)
+                action_ids = self.agent.take_actions(state_ids)
+                next_states, rewards, done = environment.step(actions[action_ids])
+                next_ids = table.encode_many(next_states)
+                # Cars sharing a state-action pair in this step contribute their mean temporal difference
+                targets = rewards + self.discount * q_values[next_ids].min(axis=1)
+                differences = targets - q_values[state_ids, action_ids]
+                pairs, inverse = np.unique(state_ids * table.num_actions + action_ids, return_inverse=True)
+                mean_differences = np.bincount(inverse, weights=differences) / np.bincount(inverse)
+                q_values.reshape(-1)[pairs] += self.learning_rate * mean_differences
+                if self.recorder is not None:
+                    self.recorder.extend(state_ids, action_ids, rewards, next_ids, done)
+                path_lengths += 1
+                self.telemetry.increment('steps', environment.num_cars)
+                path.append(tuple(int(v) for v in next_states[0]))
+                for car in np.flatnonzero(done):
+                    self.telemetry.record('episode_cost', path_lengths[car])
+                    q.appendleft(path_lengths[car])
+                    if len(q) == 25:
+                        cost = sum(q) / len(q)
+                        self.telemetry.record('avg_cost', cost)
+                        q.pop()
+                    self.learning_rate -= 0.0001
+                    self.learning_rate = max(self.learning_rate, 0.001)
+                    num_iterations += 1
+                    if self.checkpoint_every and num_iterations % self.checkpoint_every == 0:
+                        self.save_checkpoint(num_iterations)
+                path_lengths[done] = 1
+                if done[0]:
+                    last_path = path
+                    path = [tuple(int(v) for v in environment.initial_state)]
+                states = environment.get_state().copy()
+        finally:
+            # Transitions logged and episodes finished before an error still reach disk
+            if self.recorder is not None:
+                self.recorder.flush()
+            self.save_checkpoint(num_iterations)
+        self.telemetry.log(EPISODE, "Average cost: ", cost)
+        self.telemetry.log(EPISODE, "Iterations: ", num_iterations, '--------------------------------------------')
+        self.telemetry.log(EPISODE, "Finished training---------------------------------------")
+        self.telemetry.flush()
+        return last_path
+
+    def save_checkpoint(self, episode):
+        """
+        Checkpoints q table if a checkpoint path is set
+        :param episode: Int
+        :return: None
+        """
+        if self.kernel is not None:
+            self.kernel.sync()
+        if self.checkpoint_path is not None:
+            save_checkpoint(self.checkpoint_path, self.q_function.transition_table, self.q_function.array, 'q', episode=episode,
+                            discount=self.discount, learning_rate=self.learning_rate, epsilon=self.agent.epsilon)
+
     def plot_avg_cost(self):
         """
         Plot average cost over time
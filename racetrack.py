@@ -1,5 +1,8 @@
-import numpy as np
+import os
 from copy import deepcopy
+from random_source import RandomSource
+from collision_oracle import CollisionOracle
+from track_compiler import CompiledTrack
 
 
 # Velocity limits
@@ -16,7 +19,8 @@ class RaceTrack:
     """
     Class for representing and abstracting the RaceTrack environment
     """
-    def __init__(self, num_rows, num_cols, layout, initial_state, reset_on_crash=False):
+    def __init__(self, num_rows, num_cols, layout, initial_state, reset_on_crash=False, random_source=None, collision_cache_size=None,
+                 track=None):
         """
         Initializes class
         :param num_rows: Int
@@ -24,13 +28,20 @@ class RaceTrack:
         :param layout: List
         :param initial_state: Tuple
         :param reset_on_crash: Boolean
+        :param random_source: RandomSource
+        :param collision_cache_size: Int, bounds the collision cache; unbounded if None
+        :param track: CompiledTrack, e.g. from track_compiler.compile_track; compiled from layout if None
         """
         self.num_rows = num_rows
         self.num_cols = num_cols
         self.layout = layout
+        self.track = CompiledTrack(num_rows, num_cols, layout) if track is None else track
         self.initial_state = initial_state
         self.current_state = deepcopy(self.initial_state)
         self.reset_on_crash = reset_on_crash
+        self.transition_table = None
+        self.random_source = RandomSource() if random_source is None else random_source
+        self.collision_oracle = CollisionOracle(self, max_size=collision_cache_size)
 
     def next_states(self, action):
         """
@@ -38,24 +49,41 @@ class RaceTrack:
         :param action: Tuple
         :return: List
         """
-        # Apply accelerations and update positions
-        new_x_velocity = min(max(self.current_state[2] + action[0], X_VEL_LO_LIM), X_VEL_UP_LIM)
-        new_y_velocity = min(max(self.current_state[3] + action[1], Y_VEL_LO_LIM), Y_VEL_UP_LIM)
-        new_x_position = min(max(self.current_state[0] + new_x_velocity, 0), self.num_cols)
-        new_y_position = min(max(self.current_state[1] + new_y_velocity, 0), self.num_rows)
-
-        unexpected_x_velocity = min(max(self.current_state[2], X_VEL_LO_LIM), X_VEL_UP_LIM)
-        unexpected_y_velocity = min(max(self.current_state[3], Y_VEL_LO_LIM), Y_VEL_UP_LIM)
-        unexpected_x_position = min(max(self.current_state[0] + unexpected_x_velocity, 0), self.num_cols)
-        unexpected_y_position = min(max(self.current_state[1] + unexpected_y_velocity, 0), self.num_rows)
-
-        # Create and validate new state
-        new_state = (new_x_position, new_y_position, new_x_velocity, new_y_velocity)
-        new_state = self.__validate_state(new_state)
-        unexpected_new_state = (unexpected_x_position, unexpected_y_position, unexpected_x_velocity, unexpected_y_velocity)
-        unexpected_new_state = self.__validate_state(unexpected_new_state)
-        possible_states = [(new_state, ACTION_SUCCESS_PROB), (unexpected_new_state, ACTION_FAIL_PROB)]
-        return possible_states
+        return self.get_next_states(self.current_state, action)
+
+    def move(self, state, x_velocity, y_velocity):
+        """
+        Moves from given state with given (already clamped) velocity, correcting for collisions
+        :param state: Tuple
+        :param x_velocity: Int
+        :param y_velocity: Int
+        :return: Tuple
+        """
+        x_position = min(max(state[0] + x_velocity, 0), self.num_cols)
+        y_position = min(max(state[1] + y_velocity, 0), self.num_rows)
+        return self.__validate_state((x_position, y_position, x_velocity, y_velocity), origin=state)
+
+    def compile(self, reachable_only=None, previous=None):
+        """
+        Builds (once) and returns the array-backed transition table for this track. Tables of a track compiled from
+        a file are cached on disk, so repeat runs on an unchanged track skip enumeration
+        :param reachable_only: Boolean, enumerate only states reachable from the initial state; None reuses
+        whichever table was built last, or builds the full one
+        :param previous: TransitionTable, full table of this track before a layout edit; moves the edit cannot
+        affect are copied from it instead of traced
+        :return: TransitionTable
+        """
+        from transition_table import TransitionTable, load_transition_table
+        if self.transition_table is None or (reachable_only is not None and self.transition_table.reachable_only != reachable_only):
+            reachable_only = bool(reachable_only)
+            cache_path = self.track.transition_table_path(reachable_only, self.reset_on_crash, self.initial_state)
+            if cache_path is not None and os.path.exists(cache_path):
+                self.transition_table = load_transition_table(cache_path, self)
+            else:
+                self.transition_table = TransitionTable(self, reachable_only=reachable_only, previous=previous)
+                if cache_path is not None:
+                    self.transition_table.save(cache_path)
+        return self.transition_table
 
     def update_state(self, action, indicate_random=False):
         """
@@ -66,11 +94,12 @@ class RaceTrack:
         """
         # Get possible next states, choose one probabilistically, and update current state
         next_states = self.next_states(action)
-        state_map = {0: next_states[0][0], 1: next_states[1][0]}
-        next_state_choice = np.random.choice([0, 1], p=[next_states[0][1], next_states[1][1]])
-        if next_state_choice == 1 and indicate_random:
-            print("Nondeterministic response")
-        self.current_state = state_map[next_state_choice]
+        if self.random_source.bernoulli(next_states[0][1]):
+            self.current_state = next_states[0][0]
+        else:
+            if indicate_random:
+                print("Nondeterministic response")
+            self.current_state = next_states[1][0]
         return self.current_state
 
     def set_state(self, state):
@@ -101,28 +130,20 @@ class RaceTrack:
         Indicates that environment is in terminal state
         :return: Boolean
         """
-        return self.layout[self.current_state[1]][self.current_state[0]] == 'F'
+        return bool(self.track.finish_mask[self.current_state[1], self.current_state[0]])
 
-    def __validate_state(self, state):
+    def __validate_state(self, state, origin=None):
         """
-        Validates and corrects given state using Bresenham's algorithm to detect collision
+        Validates and corrects given state, detecting collisions along the Bresenham line through the collision oracle
         :param state: Tuple
+        :param origin: Tuple, defaults to current state
         :return: Tuple
         """
-        line = list(self.bresenham(self.current_state[0], self.current_state[1], state[0], state[1]))
-        i = 0
-        collision = False
-        x_position = state[0]
-        y_position = state[1]
+        if origin is None:
+            origin = self.current_state
+        x_position, y_position, collision = self.collision_oracle.first_hit(origin[0], origin[1], state[0], state[1])
         x_velocity = state[2]
         y_velocity = state[3]
-        while i < len(line) and not collision:
-            if self.layout[line[i][1]][line[i][0]] != '#':
-                x_position = line[i][0]
-                y_position = line[i][1]
-            else:
-                collision = True
-            i += 1
         if collision:
             if self.reset_on_crash:
                 x_position, y_position, x_velocity, y_velocity = self.initial_state
@@ -138,7 +159,7 @@ class RaceTrack:
         :return: Set
         """
         states = {(x, y, vx, vy) for x in range(0, self.num_cols) for y in range(0, self.num_rows) for vx in range(X_VEL_LO_LIM, X_VEL_UP_LIM + 1) for vy in
-                  range(Y_VEL_LO_LIM, Y_VEL_UP_LIM + 1) if self.layout[y][x] != '#'}
+                  range(Y_VEL_LO_LIM, Y_VEL_UP_LIM + 1) if not self.track.wall_mask[y, x]}
         return states
 
     def get_next_states(self, state, action):
@@ -149,23 +170,14 @@ class RaceTrack:
         :return: List
         """
         # Apply accelerations and update positions
-        new_x_velocity = min(max(state[2] + action[0], X_VEL_LO_LIM),
-                             X_VEL_UP_LIM)
-        new_y_velocity = min(max(state[3] + action[1], Y_VEL_LO_LIM),
-                             Y_VEL_UP_LIM)
-        new_x_position = min(max(state[0] + new_x_velocity, 0), self.num_cols)
-        new_y_position = min(max(state[1] + new_y_velocity, 0), self.num_rows)
-
-        unexpected_x_velocity = min(max(self.current_state[2], X_VEL_LO_LIM), X_VEL_UP_LIM)
-        unexpected_y_velocity = min(max(self.current_state[3], Y_VEL_LO_LIM), Y_VEL_UP_LIM)
-        unexpected_x_position = min(max(self.current_state[0] + unexpected_x_velocity, 0), self.num_cols)
-        unexpected_y_position = min(max(self.current_state[1] + unexpected_y_velocity, 0), self.num_rows)
-
-        # Create and validate new state
-        new_state = (new_x_position, new_y_position, new_x_velocity, new_y_velocity)
-        new_state = self.__validate_state(new_state)
-        unexpected_new_state = (unexpected_x_position, unexpected_y_position, unexpected_x_velocity, unexpected_y_velocity)
-        unexpected_new_state = self.__validate_state(unexpected_new_state)
+        new_x_velocity = min(max(state[2] + action[0], X_VEL_LO_LIM), X_VEL_UP_LIM)
+        new_y_velocity = min(max(state[3] + action[1], Y_VEL_LO_LIM), Y_VEL_UP_LIM)
+        unexpected_x_velocity = min(max(state[2], X_VEL_LO_LIM), X_VEL_UP_LIM)
+        unexpected_y_velocity = min(max(state[3], Y_VEL_LO_LIM), Y_VEL_UP_LIM)
+
+        # Create and validate new states
+        new_state = self.move(state, new_x_velocity, new_y_velocity)
+        unexpected_new_state = self.move(state, unexpected_x_velocity, unexpected_y_velocity)
         possible_states = [(new_state, ACTION_SUCCESS_PROB), (unexpected_new_state, ACTION_FAIL_PROB)]
         return possible_states
 
@@ -177,15 +189,10 @@ class RaceTrack:
         """
         x_position = state[0]
         y_position = state[1]
-        track_symbol = self.layout[y_position][x_position]
-        if  track_symbol == '.':
-            return 1
-        elif track_symbol == 'S':
-            return 1
-        elif track_symbol == 'F':
-            return 0
-        else:
+        if self.track.wall_mask[y_position, x_position]:
             print("Invalid state")
+            return None
+        return int(self.track.reward_grid[y_position, x_position])
 
     def reward(self):
         """
@@ -194,13 +201,9 @@ class RaceTrack:
         """
         x_position = self.current_state[0]
         y_position = self.current_state[1]
-        track_symbol = self.layout[y_position][x_position]
-        if  track_symbol == '.':
-            return 1
-        elif track_symbol == 'S':
-            return 1
-        elif track_symbol == 'F':
-            return 0
+        if self.track.wall_mask[y_position, x_position]:
+            return None
+        return int(self.track.reward_grid[y_position, x_position])
 
     def bresenham(self, x0, y0, x1, y1):
         """
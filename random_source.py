@@ -0,0 +1,81 @@
+import numpy as np
+
+
+class RandomSource:
+    """
+    Class for serving uniform random variates from pre-drawn blocks
+    """
+    def __init__(self, seed=None, block_size=65536):
+        """
+        Initializes class
+        :param seed: Int, numpy.random.Generator or None
+        :param block_size: Int
+        """
+        self.generator = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+        self.block_size = block_size
+        self.block = np.empty(0)
+        self.position = 0
+
+    def __refill(self):
+        """
+        Draws a new block of uniform variates
+        :return: None
+        """
+        self.block = self.generator.random(self.block_size)
+        self.position = 0
+
+    def uniform(self):
+        """
+        Returns next uniform variate in [0, 1)
+        :return: Float
+        """
+        if self.position >= len(self.block):
+            self.__refill()
+        value = self.block[self.position]
+        self.position += 1
+        return value
+
+    def uniforms(self, size):
+        """
+        Returns next given number of uniform variates, in the same order uniform() would serve them
+        :param size: Int
+        :return: Array
+        """
+        values = np.empty(size)
+        filled = 0
+        while filled < size:
+            if self.position >= len(self.block):
+                self.__refill()
+            count = min(size - filled, len(self.block) - self.position)
+            values[filled:filled + count] = self.block[self.position:self.position + count]
+            self.position += count
+            filled += count
+        return values
+
+    def current_block(self, minimum=1):
+        """
+        Returns current block of variates and the position of the one uniform() would serve next, without consuming any
+        :param minimum: Int, a shorter remainder is extended with a fresh block
+        :return: Tuple of Array and Int
+        """
+        if len(self.block) - self.position < minimum:
+            # Generator draws are a single stream, so appending a block keeps the order uniform() would serve
+            self.block = np.concatenate((self.block[self.position:], self.generator.random(self.block_size)))
+            self.position = 0
+        return self.block, self.position
+
+    def advance(self, count):
+        """
+        Consumes given number of variates from the current block
+        :param count: Int
+        :return: None
+        """
+        self.position += count
+
+    def bernoulli(self, probability):
+        """
+        Returns whether an event with given probability occurred
+        :param probability: Float
+        :return: Boolean
+        """
+        return self.uniform() < probability
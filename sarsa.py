@@ -1,5 +1,10 @@
 import numpy as np
 from collections import deque
+from eligibility_traces import EligibilityTraces
+from episode_kernel import EpisodeKernel
+from tables import QTable, state_index
+from checkpoint import save_checkpoint
+from telemetry import Telemetry, EPISODE, STEP
 import matplotlib.pyplot as plt
 
 
@@ -7,7 +12,9 @@ class Sarsa:
     """
     Class that implements Sarsa algorithm
     """
-    def __init__(self, discount, learning_rate, threshold, max_iterations, environment, agent):
+    def __init__(self, discount, learning_rate, threshold, max_iterations, environment, agent, telemetry=None, initial_q=None,
+                 checkpoint_path=None, checkpoint_every=None, trace_decay=0.0, replacing_traces=False,
+                 backend='python', recorder=None):
         """
         Initializes class
         :param discount: Float
@@ -16,6 +23,16 @@ class Sarsa:
         :param max_iterations: Int
         :param environment: RaceTrack
         :param agent: Car
+        :param telemetry: Telemetry
+        :param initial_q: Array of shape (num_states, num_actions) in transition table order to start from instead
+        of zeros, e.g. from Checkpoint.values_for
+        :param checkpoint_path: String, q table is checkpointed here at the end of the run, also an interrupted one
+        :param checkpoint_every: Int, also checkpoint every this many episodes
+        :param trace_decay: Float, lambda of SARSA(lambda); 0 keeps one-step backups
+        :param replacing_traces: Boolean, replacing instead of accumulating eligibility traces
+        :param backend: String, 'python' steps through Car and RaceTrack; 'kernel' runs whole episodes in an EpisodeKernel,
+        with identical results under a fixed seed
+        :param recorder: TrajectoryLog that every real transition is appended to, e.g. for FittedQIteration
         """
         self.discount = discount
         self.learning_rate = learning_rate
@@ -23,18 +40,48 @@ class Sarsa:
         self.max_iterations = max_iterations
         self.environment = environment
         self.agent = agent
-        self.avg_costs = []
+        self.telemetry = Telemetry() if telemetry is None else telemetry
+        self.initial_q = initial_q
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.trace_decay = trace_decay
+        self.replacing_traces = replacing_traces
+        self.traces = None
+        self.backend = backend
+        self.kernel = None
+        self.recorder = recorder
+
+    @property
+    def avg_costs(self):
+        """
+        Returns average cost over the last 25 episodes, recorded after every episode once 25 have run
+        :return: List
+        """
+        return self.telemetry.history('avg_cost')
 
     def __initialize_values(self):
         """
         Initializes q function
         :return: None
         """
-        self.all_states = self.environment.get_all_states()
         self.all_actions = self.agent.get_all_actions()
-        self.state_action_pairs = {(s, a) for s in self.all_states for a in self.all_actions}
-        self.q_function = {k: v for (k, v) in zip(self.state_action_pairs, np.zeros(len(self.state_action_pairs)))}
+        initial_q = None if self.initial_q is None else np.array(self.initial_q, dtype=np.float64)
+        self.q_function = QTable(self.environment.compile(), initial_q)
         self.agent.set_q_function(self.q_function)
+        if self.trace_decay:
+            self.traces = EligibilityTraces(self.q_function.array.size, replacing=self.replacing_traces)
+        if self.backend == 'kernel':
+            if self.trace_decay:
+                raise ValueError("The episode kernel only runs one-step updates")
+            if self.recorder is not None:
+                raise ValueError("The episode kernel does not record transitions")
+            if self.agent.random_source is not self.environment.random_source:
+                raise ValueError("The episode kernel needs the car and the track to share one random source")
+            self.kernel = EpisodeKernel(self.q_function, sarsa=True)
+        if self.recorder is not None:
+            table = self.q_function.transition_table
+            self.recorder.check_table(self.environment.track.table_key(table.reachable_only, self.environment.reset_on_crash,
+                                                                       self.environment.initial_state))
 
     def run(self):
         """
@@ -46,33 +93,91 @@ class Sarsa:
         cost = np.inf
         i = 0
         path = []
-        while cost > self.threshold and i < self.max_iterations:
-            initial_state = self.environment.reset_state()
-            current_state = initial_state
-            path = [current_state]
-            current_action = self.agent.take_action(current_state)
-            while not self.environment.in_terminal_state():
-                next_state = self.environment.update_state(current_action, indicate_random=True)
-                reward = self.environment.get_reward(next_state)
-                next_action = self.agent.take_action(next_state)
-                current_q = self.q_function[(current_state, current_action)]
-                next_q = self.q_function[(next_state, next_action)]
-                self.q_function[(current_state, current_action)] += self.learning_rate * (reward + self.discount * next_q - current_q)
-                print(current_state, next_state, current_action, '\n')
-                current_state, current_action = next_state, next_action
-                path.append(current_state)
-            self.learning_rate -= 0.0001
-            q.appendleft(len(path))
-            if len(q) == 25:
-                cost = sum(q) / len(q)
-                print("Average cost: ", cost)
-                print("Iterations: ", i, '--------------------------------------------')
-                self.avg_costs.append(cost)
-                q.pop()
-            i += 1
-        print("Finished training---------------------------------------")
+        log_steps = self.telemetry.enabled(STEP)
+        try:
+            while cost > self.threshold and i < self.max_iterations:
+                self.telemetry.start_timer('episode_seconds')
+                initial_state = self.environment.reset_state()
+                current_state = initial_state
+                path = [current_state]
+                if self.kernel is not None:
+                    path = self.kernel.run_episode(initial_state, self.agent, self.learning_rate, self.discount,
+                                                   self.environment.random_source)
+                else:
+                    current_action = self.agent.take_action(current_state)
+                    if self.traces is not None:
+                        self.traces.clear()
+                    while not self.environment.in_terminal_state():
+                        next_state = self.environment.update_state(current_action, indicate_random=log_steps)
+                        reward = self.environment.get_reward(next_state)
+                        next_action = self.agent.take_action(next_state)
+                        if self.recorder is not None:
+                            self.__record(current_state, current_action, next_state, reward)
+                        current_q = self.q_function[(current_state, current_action)]
+                        next_q = self.q_function[(next_state, next_action)]
+                        if self.traces is None:
+                            self.q_function[(current_state, current_action)] += self.learning_rate * (reward + self.discount * next_q - current_q)
+                        else:
+                            # Every pair visited this episode moves in proportion to its trace
+                            state_id, action_id = self.q_function.index((current_state, current_action))
+                            self.traces.visit(state_id * len(self.all_actions) + action_id)
+                            self.traces.apply(self.q_function.array.reshape(-1), self.learning_rate * (reward + self.discount * next_q - current_q))
+                            self.traces.decay(self.discount * self.trace_decay)
+                        if log_steps:
+                            self.telemetry.log(STEP, current_state, next_state, current_action, '\n')
+                        current_state, current_action = next_state, next_action
+                        path.append(current_state)
+                self.learning_rate -= 0.0001
+                self.telemetry.stop_timer('episode_seconds')
+                self.telemetry.record('episode_cost', len(path))
+                self.telemetry.increment('steps', len(path) - 1)
+                q.appendleft(len(path))
+                if len(q) == 25:
+                    cost = sum(q) / len(q)
+                    self.telemetry.log(EPISODE, "Average cost: ", cost)
+                    self.telemetry.log(EPISODE, "Iterations: ", i, '--------------------------------------------')
+                    self.telemetry.record('avg_cost', cost)
+                    q.pop()
+                i += 1
+                if self.checkpoint_every and i % self.checkpoint_every == 0:
+                    self.save_checkpoint(i)
+        finally:
+            # Transitions logged and episodes finished before an error still reach disk
+            if self.recorder is not None:
+                self.recorder.flush()
+            self.save_checkpoint(i)
+        self.telemetry.log(EPISODE, "Finished training---------------------------------------")
+        self.telemetry.flush()
+        if self.kernel is not None:
+            path = self.kernel.decode_path(path, self.environment)
         return path
 
+    def __record(self, state, action, next_state, reward):
+        """
+        Appends transition to the recorder
+        :param state: Tuple
+        :param action: Tuple
+        :param next_state: Tuple
+        :param reward: Int
+        :return: None
+        """
+        table = self.q_function.transition_table
+        state_id, action_id = self.q_function.index((state, action))
+        next_id = state_index(table, next_state)
+        self.recorder.append(state_id, action_id, reward, next_id, table.terminal[next_id])
+
+    def save_checkpoint(self, episode):
+        """
+        Checkpoints q table if a checkpoint path is set
+        :param episode: Int
+        :return: None
+        """
+        if self.kernel is not None:
+            self.kernel.sync()
+        if self.checkpoint_path is not None:
+            save_checkpoint(self.checkpoint_path, self.q_function.transition_table, self.q_function.array, 'q', episode=episode,
+                            discount=self.discount, learning_rate=self.learning_rate, epsilon=self.agent.epsilon)
+
     def plot_avg_cost(self):
         """
         Plot average cost over time
@@ -0,0 +1,95 @@
+import itertools
+import json
+import os
+import time
+from multiprocessing import Pool
+from car import Car
+from main import read_track
+from q_learning import QLearning
+from racetrack import RaceTrack
+from random_source import RandomSource
+from sarsa import Sarsa
+from telemetry import Telemetry, QUIET, EPISODE
+
+
+LEARNERS = {'q_learning': QLearning, 'sarsa': Sarsa}
+
+# Parsed track shared by every run in a worker process
+_track = {}
+
+def build_grid(**parameters):
+    """
+    Expands lists of parameter values into every combination
+    :param parameters: Lists of values keyed by main() parameter name, e.g. algorithm=['sarsa'], epsilon=[0.3, 0.5]
+    :return: List of Dicts
+    """
+    names = list(parameters)
+    return [dict(zip(names, values)) for values in itertools.product(*(parameters[name] for name in names))]
+
+def _share_track(rows, cols, layout, transition_tables):
+    """
+    Worker initializer: keeps the parsed track and its compiled transition tables for every run in this process
+    :param rows: Int
+    :param cols: Int
+    :param layout: List
+    :param transition_tables: Dict of TransitionTable keyed by reset_on_crash
+    :return: None
+    """
+    _track.update(rows=rows, cols=cols, layout=layout, transition_tables=transition_tables)
+
+def _run_config(task):
+    """
+    Runs one learner configuration with one seed
+    :param task: Tuple of config Dict, seed and initial state
+    :return: Dict
+    """
+    config, seed, initial_state = task
+    random_source = RandomSource(seed)
+    agent = Car((0, 0), config['epsilon'], random_source=random_source)
+    reset_on_crash = config.get('reset_on_crash', False)
+    environment = RaceTrack(_track['rows'], _track['cols'], _track['layout'], initial_state,
+                            reset_on_crash=reset_on_crash, random_source=random_source)
+    environment.transition_table = _track['transition_tables'][reset_on_crash]
+    learner = LEARNERS[config['algorithm']](config['discount'], config['learning_rate'], config['threshold'],
+                                            config['max_iterations'], environment, agent, telemetry=Telemetry(QUIET))
+    start = time.perf_counter()
+    path = learner.run()
+    return {
+        'config': config,
+        'seed': seed,
+        'seconds': time.perf_counter() - start,
+        'avg_costs': [float(cost) for cost in learner.avg_costs],
+        'path': [list(state) for state in path],
+    }
+
+def run_sweep(track, x_start, y_start, configs, seeds, results_path, num_workers=None, telemetry=None):
+    """
+    Runs every config with every seed on a process pool, streaming each result to a JSON lines file as it finishes
+    :param track: String, path to track file
+    :param x_start: Int
+    :param y_start: Int
+    :param configs: List of Dicts with algorithm, discount, learning_rate, threshold, max_iterations, epsilon
+    and optionally reset_on_crash
+    :param seeds: List of Ints
+    :param results_path: String
+    :param num_workers: Int, defaults to the number of cores
+    :param telemetry: Telemetry that each finished run is logged to
+    :return: List of Dicts
+    """
+    telemetry = Telemetry() if telemetry is None else telemetry
+    rows, cols, layout = read_track(track)
+    initial_state = (x_start, y_start, 0, 0)
+    # Parse and enumerate once; workers receive the result instead of rebuilding it
+    transition_tables = {reset_on_crash: RaceTrack(rows, cols, layout, initial_state, reset_on_crash=reset_on_crash).compile()
+                         for reset_on_crash in {config.get('reset_on_crash', False) for config in configs}}
+    tasks = [(config, seed, initial_state) for config in configs for seed in seeds]
+    results = []
+    with Pool(num_workers or os.cpu_count(), initializer=_share_track, initargs=(rows, cols, layout, transition_tables)) as pool, \
+            open(results_path, 'a') as f:
+        for result in pool.imap_unordered(_run_config, tasks):
+            result['track'] = track
+            f.write(json.dumps(result) + '\n')
+            f.flush()
+            results.append(result)
+            telemetry.log(EPISODE, "Finished: ", result['config'], "seed", result['seed'], "in", round(result['seconds'], 2), "s")
+    return results
@@ -0,0 +1,106 @@
+import numpy as np
+from collections.abc import Mapping
+
+
+def state_index(transition_table, state):
+    """
+    Returns dense id of given state, raising KeyError for states off the track
+    :param transition_table: TransitionTable
+    :param state: Tuple
+    :return: Int
+    """
+    try:
+        in_track = transition_table.cell_index[state[1], state[0]] >= 0
+    except (IndexError, TypeError):
+        in_track = False
+    if not in_track:
+        raise KeyError(state)
+    state_id = transition_table.encode(state)
+    if state_id < 0:
+        raise KeyError(state)
+    return state_id
+
+class ValueTable(Mapping):
+    """
+    Class for exposing an array-backed value function through dict-style state access
+    """
+    def __init__(self, transition_table, values=None):
+        """
+        Initializes table
+        :param transition_table: TransitionTable
+        :param values: Array of shape (num_states,), defaults to zeros
+        """
+        self.transition_table = transition_table
+        self.array = np.zeros(transition_table.num_states) if values is None else values
+
+    def index(self, state):
+        """
+        Returns array index of given state
+        :param state: Tuple
+        :return: Int
+        """
+        return state_index(self.transition_table, state)
+
+    def __getitem__(self, state):
+        return self.array[self.index(state)]
+
+    def __setitem__(self, state, value):
+        self.array[self.index(state)] = value
+
+    def __iter__(self):
+        for state_id in range(self.transition_table.num_states):
+            yield self.transition_table.decode(state_id)
+
+    def __len__(self):
+        return self.transition_table.num_states
+
+class QTable(Mapping):
+    """
+    Class for exposing an array-backed q function through dict-style (state, action) access
+    """
+    def __init__(self, transition_table, values=None):
+        """
+        Initializes table
+        :param transition_table: TransitionTable
+        :param values: Array of shape (num_states, num_actions), defaults to zeros
+        """
+        self.transition_table = transition_table
+        self.actions = transition_table.actions
+        self.action_index = transition_table.action_index
+        if values is None:
+            values = np.zeros((transition_table.num_states, transition_table.num_actions))
+        self.array = values
+
+    def index(self, state_action):
+        """
+        Returns array index of given state-action pair
+        :param state_action: Tuple
+        :return: Tuple
+        """
+        state, action = state_action
+        if action not in self.action_index:
+            raise KeyError(state_action)
+        return state_index(self.transition_table, state), self.action_index[action]
+
+    def greedy_action(self, state):
+        """
+        Returns action with lowest value in given state
+        :param state: Tuple
+        :return: Tuple
+        """
+        return self.actions[int(np.argmin(self.array[state_index(self.transition_table, state)]))]
+
+    def __getitem__(self, state_action):
+        return self.array[self.index(state_action)]
+
+    def __setitem__(self, state_action, value):
+        self.array[self.index(state_action)] = value
+
+    def __iter__(self):
+        for state_id in range(self.transition_table.num_states):
+            state = self.transition_table.decode(state_id)
+            for action in self.actions:
+                yield state, action
+
+    def __len__(self):
+        return self.array.size
@@ -0,0 +1,165 @@
+import csv
+import json
+import time
+import numpy as np
+
+
+# Verbosity levels
+QUIET = 0
+EPISODE = 1
+STEP = 2
+
+class RingBuffer:
+    """
+    Class for holding the most recent values of one metric in a preallocated array
+    """
+    def __init__(self, capacity):
+        """
+        Initializes buffer
+        :param capacity: Int
+        """
+        self.values = np.empty(capacity)
+        self.count = 0
+        self.flushed = 0
+
+    def append(self, value):
+        """
+        Stores value, overwriting the oldest one when full
+        :param value: Float
+        :return: None
+        """
+        self.values[self.count % len(self.values)] = value
+        self.count += 1
+
+    def unflushed(self):
+        """
+        Returns indices and values recorded since the last flush that are still held
+        :return: Tuple of range and Array
+        """
+        start = max(self.flushed, self.count - len(self.values))
+        indices = range(start, self.count)
+        return indices, self.values[[i % len(self.values) for i in indices]]
+
+    def recent(self):
+        """
+        Returns held values, oldest first
+        :return: Array
+        """
+        start = max(0, self.count - len(self.values))
+        return self.values[[i % len(self.values) for i in range(start, self.count)]]
+
+class Telemetry:
+    """
+    Class for collecting training counters, timers and metrics without printing in hot loops
+    """
+    def __init__(self, verbosity=EPISODE, capacity=4096, path=None, history=('avg_cost', 'max_diff')):
+        """
+        Initializes class
+        :param verbosity: Int, QUIET, EPISODE or STEP
+        :param capacity: Int, values held per metric between flushes
+        :param path: String, flush target; '.csv' writes CSV, anything else JSON lines
+        :param history: Tuple, metrics whose full history is kept in memory
+        """
+        self.verbosity = verbosity
+        self.capacity = capacity
+        self.path = path
+        self.buffers = {}
+        self.histories = {name: [] for name in history}
+        self.counters = {}
+        self.timers = {}
+
+    def enabled(self, level):
+        """
+        Indicates that messages of given level are shown; hot loops check this once and skip logging entirely
+        :param level: Int
+        :return: Boolean
+        """
+        return self.verbosity >= level
+
+    def log(self, level, *message):
+        """
+        Prints message if verbosity allows it
+        :param level: Int
+        :param message: Objects to print
+        :return: None
+        """
+        if self.verbosity >= level:
+            print(*message)
+
+    def increment(self, name, amount=1):
+        """
+        Increments counter
+        :param name: String
+        :param amount: Int
+        :return: None
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def start_timer(self, name):
+        """
+        Starts (or restarts) timer
+        :param name: String
+        :return: None
+        """
+        self.timers[name] = time.perf_counter()
+
+    def stop_timer(self, name):
+        """
+        Records seconds since timer was started as a metric of the same name
+        :param name: String
+        :return: Float
+        """
+        seconds = time.perf_counter() - self.timers.pop(name)
+        self.record(name, seconds)
+        return seconds
+
+    def record(self, name, value):
+        """
+        Records metric value, flushing to file before unflushed values would be overwritten
+        :param name: String
+        :param value: Float
+        :return: None
+        """
+        buffer = self.buffers.get(name)
+        if buffer is None:
+            buffer = self.buffers[name] = RingBuffer(self.capacity)
+        elif self.path is not None and buffer.count - buffer.flushed >= self.capacity:
+            self.flush()
+        buffer.append(value)
+        if name in self.histories:
+            self.histories[name].append(value)
+
+    def history(self, name):
+        """
+        Returns every value recorded for a metric kept in history
+        :param name: String
+        :return: List
+        """
+        return self.histories.setdefault(name, [])
+
+    def recent(self, name):
+        """
+        Returns most recent values of a metric
+        :param name: String
+        :return: Array
+        """
+        return self.buffers[name].recent() if name in self.buffers else np.empty(0)
+
+    def flush(self):
+        """
+        Appends values recorded since the last flush, and current counters, to the flush target
+        :return: None
+        """
+        if self.path is None:
+            return
+        rows = []
+        for name, buffer in self.buffers.items():
+            indices, values = buffer.unflushed()
+            rows.extend((name, index, float(value)) for (index, value) in zip(indices, values))
+            buffer.flushed = buffer.count
+        rows.extend(('counter:' + name, 0, value) for (name, value) in self.counters.items())
+        with open(self.path, 'a', newline='') as f:
+            if self.path.endswith('.csv'):
+                csv.writer(f).writerows(rows)
+            else:
+                f.writelines(json.dumps({'metric': name, 'index': index, 'value': value}) + '\n' for (name, index, value) in rows)
@@ -0,0 +1,106 @@
+import numpy as np
+from collections import OrderedDict
+
+
+class TiledArray:
+    """
+    Class for a disk-backed array split into tiles of consecutive rows. At most max_tiles tiles are held in memory;
+    the least recently used one is evicted, and written back only if it was modified
+    """
+    def __init__(self, path, shape, bounds, max_tiles=4, dtype=np.float64, fill_value=0.0):
+        """
+        Creates backing .npy file, so the array can be reopened with np.load(path, mmap_mode='r')
+        :param path: String
+        :param shape: Tuple, first axis is split into tiles
+        :param bounds: Array of tile boundaries along the first axis, from 0 to shape[0]
+        :param max_tiles: Int
+        :param dtype: Numpy dtype
+        :param fill_value: Float
+        """
+        self.path = path
+        self.bounds = np.asarray(bounds, dtype=np.int64)
+        self.num_tiles = len(self.bounds) - 1
+        self.max_tiles = max_tiles
+        self.data = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+        if fill_value:
+            for index in range(self.num_tiles):
+                self.data[self.bounds[index]:self.bounds[index + 1]] = fill_value
+        self.cache = OrderedDict()
+        self.dirty = set()
+        self.tile_reads = 0
+        self.tile_writes = 0
+
+    def tile_of(self, ids):
+        """
+        Returns tile holding each of given rows
+        :param ids: Array
+        :return: Array
+        """
+        return np.searchsorted(self.bounds, ids, side='right') - 1
+
+    def tile(self, index):
+        """
+        Returns tile, loading it into the cache if needed. The returned array is only valid until the next load;
+        changes must go through set_tile
+        :param index: Int
+        :return: Array
+        """
+        values = self.cache.get(index)
+        if values is not None:
+            self.cache.move_to_end(index)
+            return values
+        values = np.array(self.data[self.bounds[index]:self.bounds[index + 1]])
+        self.tile_reads += 1
+        self.cache[index] = values
+        while len(self.cache) > self.max_tiles:
+            evicted, evicted_values = self.cache.popitem(last=False)
+            if evicted in self.dirty:
+                self.__write(evicted, evicted_values)
+        return values
+
+    def set_tile(self, index, values):
+        """
+        Replaces values of tile
+        :param index: Int
+        :param values: Array
+        :return: None
+        """
+        self.tile(index)[...] = values
+        self.dirty.add(index)
+
+    def take(self, ids):
+        """
+        Gathers given rows, loading each tile they fall in once
+        :param ids: Array of row indices
+        :return: Array
+        """
+        ids = np.asarray(ids).reshape(-1)
+        values = np.empty((len(ids),) + self.data.shape[1:], dtype=self.data.dtype)
+        tiles = self.tile_of(ids)
+        order = np.argsort(tiles, kind='stable')
+        splits = np.flatnonzero(np.diff(tiles[order])) + 1
+        for rows in np.split(order, splits):
+            if len(rows):
+                index = int(tiles[rows[0]])
+                values[rows] = self.tile(index)[ids[rows] - self.bounds[index]]
+        return values
+
+    def flush(self):
+        """
+        Writes modified cached tiles back to disk
+        :return: None
+        """
+        for index in sorted(self.dirty & set(self.cache)):
+            self.__write(index, self.cache[index])
+        self.data.flush()
+
+    def __write(self, index, values):
+        """
+        Writes tile to disk
+        :param index: Int
+        :param values: Array
+        :return: None
+        """
+        self.data[self.bounds[index]:self.bounds[index + 1]] = values
+        self.dirty.discard(index)
+        self.tile_writes += 1
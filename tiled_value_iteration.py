@@ -0,0 +1,162 @@
+import os
+import numpy as np
+from car import ACTIONS
+from racetrack import RaceTrack, X_VEL_LO_LIM, X_VEL_UP_LIM, Y_VEL_LO_LIM, Y_VEL_UP_LIM, ACTION_SUCCESS_PROB, ACTION_FAIL_PROB
+from telemetry import Telemetry, EPISODE
+from tiled_array import TiledArray
+from transition_table import NUM_VELOCITIES, NUM_Y_VELOCITIES
+from value_iteration import bellman_backup
+
+
+# Collision results kept while building a model; every move is traced once, so a large cache would only hold memory
+MODEL_COLLISION_CACHE_SIZE = 1024
+
+def build_tiled_model(environment, directory, tile_rows=8):
+    """
+    Writes the full transition model of environment to memory-mapped .npy files, one band of tile_rows track rows at a
+    time, so the model is never resident as a whole. States are numbered like a full TransitionTable: cells row by row,
+    so every band of rows is one contiguous range of state ids
+    :param environment: RaceTrack
+    :param directory: String
+    :param tile_rows: Int
+    :return: Dict with memory-mapped next_success, next_fail and terminal arrays, cell_index and tile bounds
+    """
+    os.makedirs(directory, exist_ok=True)
+    num_rows, num_cols = environment.num_rows, environment.num_cols
+    track = environment.track
+    # Moves are traced on a copy of the environment with a bounded collision cache
+    environment = RaceTrack(num_rows, num_cols, environment.layout, environment.initial_state, reset_on_crash=environment.reset_on_crash,
+                            random_source=environment.random_source, collision_cache_size=MODEL_COLLISION_CACHE_SIZE, track=track)
+    open_cells = ~track.wall_mask[:num_rows, :num_cols]
+    cell_index = np.full((num_rows, num_cols), -1, dtype=np.int64)
+    cell_index[open_cells] = np.arange(np.count_nonzero(open_cells))
+    row_starts = np.concatenate(([0], np.cumsum(open_cells.sum(axis=1))))
+    bounds = row_starts[np.append(np.arange(0, num_rows, tile_rows), num_rows)] * NUM_VELOCITIES
+    num_states = int(bounds[-1])
+
+    model = {
+        'next_success': np.lib.format.open_memmap(os.path.join(directory, 'next_success.npy'), mode='w+', dtype=np.int32,
+                                                  shape=(num_states, len(ACTIONS))),
+        'next_fail': np.lib.format.open_memmap(os.path.join(directory, 'next_fail.npy'), mode='w+', dtype=np.int32, shape=(num_states,)),
+        'terminal': np.lib.format.open_memmap(os.path.join(directory, 'terminal.npy'), mode='w+', dtype=bool, shape=(num_states,)),
+    }
+    velocities = [(vx, vy) for vx in range(X_VEL_LO_LIM, X_VEL_UP_LIM + 1) for vy in range(Y_VEL_LO_LIM, Y_VEL_UP_LIM + 1)]
+    x_velocity_ids, y_velocity_ids = np.divmod(np.arange(NUM_VELOCITIES), NUM_Y_VELOCITIES)
+    for index in range(len(bounds) - 1):
+        cell_ys, cell_xs = np.nonzero(open_cells[index * tile_rows:(index + 1) * tile_rows])
+        cell_ys += index * tile_rows
+        # A successful action moves with the accelerated velocity, a failed one with the current velocity, so every
+        # successor of the band's states is the outcome of a (cell, velocity) move from the band
+        moves = np.empty((len(cell_xs), NUM_VELOCITIES), dtype=np.int64)
+        for i, (x, y) in enumerate(zip(cell_xs.tolist(), cell_ys.tolist())):
+            for velocity_id, (vx, vy) in enumerate(velocities):
+                next_x, next_y, next_vx, next_vy = environment.move((x, y, vx, vy), vx, vy)
+                moves[i, velocity_id] = (cell_index[next_y, next_x] * NUM_VELOCITIES + (next_vx - X_VEL_LO_LIM) * NUM_Y_VELOCITIES
+                                         + next_vy - Y_VEL_LO_LIM)
+        start, stop = bounds[index], bounds[index + 1]
+        for action_id, (ax, ay) in enumerate(ACTIONS):
+            accelerated = (np.clip(x_velocity_ids + ax, 0, X_VEL_UP_LIM - X_VEL_LO_LIM) * NUM_Y_VELOCITIES
+                           + np.clip(y_velocity_ids + ay, 0, Y_VEL_UP_LIM - Y_VEL_LO_LIM))
+            model['next_success'][start:stop, action_id] = moves[:, accelerated].reshape(-1)
+        model['next_fail'][start:stop] = moves.reshape(-1)
+        model['terminal'][start:stop] = np.repeat(track.finish_mask[cell_ys, cell_xs], NUM_VELOCITIES)
+    for array in model.values():
+        array.flush()
+    model['cell_index'] = cell_index
+    model['bounds'] = bounds
+    return model
+
+class TiledValueIteration:
+    """
+    Class that implements Value Iteration for tracks whose model and values do not fit in memory. Both live in
+    memory-mapped files tiled by bands of track rows; sweeps back up one tile at a time, in place, so a tile only needs
+    the values of the tiles a move can reach from it, and a small tile cache keeps I/O to about one read and one write
+    of each tile per sweep
+    """
+    def __init__(self, discount, threshold, max_iterations, environment, agent, directory, tile_rows=8, max_tiles=4,
+                 telemetry=None):
+        """
+        Initializes algorithm
+        :param discount: Float
+        :param threshold: Float
+        :param max_iterations: Int
+        :param environment: RaceTrack
+        :param agent: Car
+        :param directory: String, model and value files are written here and kept after the run
+        :param tile_rows: Int, track rows per tile; at least the maximum speed, so moves only reach neighbouring tiles
+        :param max_tiles: Int, value tiles held in memory
+        :param telemetry: Telemetry
+        """
+        max_speed = max(Y_VEL_UP_LIM, -Y_VEL_LO_LIM)
+        if tile_rows < max_speed:
+            raise ValueError("Tiles need at least {} rows, the maximum speed, so moves only reach neighbouring tiles".format(max_speed))
+        self.discount = discount
+        self.threshold = threshold
+        self.max_iterations = max_iterations
+        self.environment = environment
+        self.agent = agent
+        self.directory = directory
+        self.tile_rows = tile_rows
+        self.max_tiles = max_tiles
+        self.telemetry = Telemetry() if telemetry is None else telemetry
+        self.num_backups = 0
+        self.model = None
+        self.value_function = None
+
+    @property
+    def max_diffs(self):
+        """
+        Returns maximum value difference of every sweep
+        :return: List
+        """
+        return self.telemetry.history('max_diff')
+
+    def run(self):
+        """
+        Runs algorithm
+        :return: TiledArray
+        """
+        self.all_actions = self.agent.get_all_actions()
+        if self.model is None:
+            self.model = build_tiled_model(self.environment, self.directory, self.tile_rows)
+        bounds = self.model['bounds']
+        values = TiledArray(os.path.join(self.directory, 'values.npy'), (int(bounds[-1]),), bounds, max_tiles=self.max_tiles)
+        self.value_function = values
+        max_difference = np.inf
+        i = 0
+        while i < self.max_iterations and max_difference > self.threshold:
+            max_difference = 0.0
+            for index in range(values.num_tiles):
+                start, stop = bounds[index], bounds[index + 1]
+                if start == stop:
+                    continue
+                next_success = np.asarray(self.model['next_success'][start:stop])
+                next_fail = np.asarray(self.model['next_fail'][start:stop])
+                reward = np.where(self.model['terminal'][start:stop], 0.0, 1.0)
+                # Back up against the successors' current values, renumbered into one gathered array
+                successors, inverse = np.unique(np.concatenate((next_success.reshape(-1), next_fail)), return_inverse=True)
+                local_success = inverse[:next_success.size].reshape(next_success.shape)
+                local_fail = np.broadcast_to(inverse[next_success.size:, None], next_success.shape)
+                new_values = bellman_backup(values.take(successors), reward, local_success, local_fail, self.discount,
+                                            ACTION_SUCCESS_PROB, ACTION_FAIL_PROB)
+                max_difference = max(max_difference, np.max(np.abs(new_values - values.tile(index))))
+                values.set_tile(index, new_values)
+                self.num_backups += stop - start
+            self.telemetry.log(EPISODE, "Maximum difference: ", max_difference)
+            self.telemetry.record('max_diff', max_difference)
+            i += 1
+            self.telemetry.log(EPISODE, "Iterations: ", i)
+        values.flush()
+        self.telemetry.log(EPISODE, "Tile reads: ", values.tile_reads, "Tile writes: ", values.tile_writes)
+        self.telemetry.flush()
+        return values
+
+    def value(self, state):
+        """
+        Returns value of given state
+        :param state: Tuple
+        :return: Float
+        """
+        state_id = (self.model['cell_index'][state[1], state[0]] * NUM_VELOCITIES + (state[2] - X_VEL_LO_LIM) * NUM_Y_VELOCITIES
+                    + state[3] - Y_VEL_LO_LIM)
+        return float(self.value_function.take([state_id])[0])
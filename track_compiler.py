@@ -0,0 +1,123 @@
+import hashlib
+import os
+import numpy as np
+from atomic_file import atomic_write
+
+
+# Compiled tracks and transition tables are cached here, keyed by a hash of the track file content
+CACHE_DIR = '.track_cache'
+# Bumped whenever the cached array layout changes, so stale cache files are never read
+CACHE_VERSION = 1
+
+class CompiledTrack:
+    """
+    Class for a track layout compiled into typed grids
+    """
+    def __init__(self, num_rows, num_cols, layout, content_hash=None, cache_dir=None, grids=None):
+        """
+        Builds grids from layout. Positions are clamped to [0, num_cols] x [0, num_rows], so grids get an extra
+        wall row and column
+        :param num_rows: Int
+        :param num_cols: Int
+        :param layout: List
+        :param content_hash: String, hash of the track file the layout was read from
+        :param cache_dir: String, transition tables of this track are cached here when content_hash is set
+        :param grids: Dict of previously compiled wall_mask, finish_mask, reward_grid and start_cells
+        """
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.layout = layout
+        self.content_hash = content_hash
+        self.cache_dir = cache_dir
+        if grids is not None:
+            self.wall_mask = grids['wall_mask']
+            self.finish_mask = grids['finish_mask']
+            self.reward_grid = grids['reward_grid']
+            self.start_cells = grids['start_cells']
+            return
+        symbols = np.full((num_rows + 1, num_cols + 1), '#')
+        for y in range(num_rows):
+            line = layout[y][:num_cols]
+            symbols[y, :len(line)] = list(line)
+        self.wall_mask = symbols == '#'
+        self.finish_mask = symbols == 'F'
+        self.reward_grid = np.where(self.wall_mask | self.finish_mask, 0, 1).astype(np.int8)
+        self.start_cells = np.argwhere(symbols == 'S')[:, ::-1].astype(np.int32)
+
+    def table_key(self, reachable_only, reset_on_crash, initial_state):
+        """
+        Returns a key identifying the transition table built with given options: the track file's content hash, or a
+        hash of the layout for tracks not read from a file, and the options that shape the table
+        :param reachable_only: Boolean
+        :param reset_on_crash: Boolean
+        :param initial_state: Tuple
+        :return: String
+        """
+        track_hash = self.content_hash
+        if track_hash is None:
+            text = '{},{}\n{}'.format(self.num_rows, self.num_cols, '\n'.join(self.layout))
+            track_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+        key = 'reachable' if reachable_only else 'full'
+        if reset_on_crash:
+            key += '-reset'
+        # The initial state only shapes the table when it is a crash target or the search root
+        if reachable_only or reset_on_crash:
+            key += '-' + '_'.join(str(v) for v in initial_state)
+        return '{}-v{}-{}'.format(track_hash, CACHE_VERSION, key)
+
+    def transition_table_path(self, reachable_only, reset_on_crash, initial_state):
+        """
+        Returns cache file of the transition table built with given options, or None if this track is not cached
+        :param reachable_only: Boolean
+        :param reset_on_crash: Boolean
+        :param initial_state: Tuple
+        :return: String
+        """
+        if self.content_hash is None or self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, self.table_key(reachable_only, reset_on_crash, initial_state) + '.npz')
+
+def parse_track(text):
+    """
+    Parses track text in the rows,cols + layout format
+    :param text: String
+    :return: Tuple of rows, columns and layout
+    """
+    lines = text.splitlines()
+    specs = lines[0].strip().split(',')
+    return int(specs[0]), int(specs[1]), lines[1:]
+
+def compile_track(path, cache_dir=CACHE_DIR):
+    """
+    Compiles track file, reusing the cached grids of a file with identical content
+    :param path: String
+    :param cache_dir: String, None disables the cache
+    :return: CompiledTrack
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+    content_hash = hashlib.sha256(content).hexdigest()[:16]
+    cache_path = None if cache_dir is None else os.path.join(cache_dir, '{}-v{}-track.npz'.format(content_hash, CACHE_VERSION))
+    if cache_path is not None and os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            num_rows, num_cols = (int(v) for v in cached['shape'])
+            grids = {name: cached[name] for name in ('wall_mask', 'finish_mask', 'reward_grid', 'start_cells')}
+            return CompiledTrack(num_rows, num_cols, cached['layout'].tolist(), content_hash, cache_dir, grids=grids)
+
+    num_rows, num_cols, layout = parse_track(content.decode('utf-8'))
+    track = CompiledTrack(num_rows, num_cols, layout, content_hash, cache_dir)
+    if cache_path is not None:
+        save_arrays(cache_path, shape=np.array([num_rows, num_cols]), layout=np.array(layout), wall_mask=track.wall_mask,
+                    finish_mask=track.finish_mask, reward_grid=track.reward_grid, start_cells=track.start_cells)
+    return track
+
+def save_arrays(path, **arrays):
+    """
+    Writes arrays to an npz file; the file is replaced atomically so concurrent runs never read a partial cache
+    :param path: String
+    :param arrays: Arrays by name
+    :return: None
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with atomic_write(path) as f:
+        np.savez(f, **arrays)
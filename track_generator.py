@@ -0,0 +1,51 @@
+import numpy as np
+
+
+def generate_track(rows, cols, obstacle_density=0.05, seed=None):
+    """
+    Generates a walled rectangular track with scattered wall blocks, start cells along the left edge
+    and finish cells along the right edge
+    :param rows: Int, at least 5
+    :param cols: Int, at least 5
+    :param obstacle_density: Float, approximate fraction of interior cells covered by wall blocks
+    :param seed: Int
+    :return: List of layout lines
+    """
+    generator = np.random.default_rng(seed)
+    grid = np.full((rows, cols), '.')
+    grid[0, :] = grid[-1, :] = grid[:, 0] = grid[:, -1] = '#'
+
+    # Square wall blocks, kept clear of the start and finish columns
+    block_size = max(1, min(rows, cols) // 10)
+    num_blocks = int(obstacle_density * (rows - 2) * (cols - 2) / block_size ** 2)
+    for _ in range(num_blocks):
+        y = generator.integers(1, max(2, rows - block_size))
+        x = generator.integers(3, max(4, cols - block_size - 3))
+        grid[y:y + block_size, x:x + block_size] = '#'
+
+    grid[1:-1, 1] = 'S'
+    grid[1:-1, -2] = 'F'
+    return [''.join(line) for line in grid]
+
+def write_track(path, layout):
+    """
+    Writes layout in the rows,cols + layout text format read by main.read_track
+    :param path: String
+    :param layout: List
+    :return: None
+    """
+    with open(path, 'w') as f:
+        f.write('{},{}\n'.format(len(layout), len(layout[0])))
+        f.write('\n'.join(layout))
+
+def find_start(layout):
+    """
+    Returns first start cell in reading order
+    :param layout: List
+    :return: Tuple
+    """
+    for y, line in enumerate(layout):
+        x = line.find('S')
+        if x >= 0:
+            return x, y
+    return None
@@ -0,0 +1,180 @@
+import json
+import os
+import numpy as np
+from atomic_file import atomic_write
+
+
+# Column names and on-disk types of a logged transition
+COLUMNS = (('state_ids', np.int32), ('action_ids', np.int8), ('rewards', np.float32), ('next_state_ids', np.int32), ('done', np.bool_))
+META_FILE = 'meta.json'
+
+class TrajectoryLog:
+    """
+    Class for an append-only log of transitions, stored column by column in raw files that are read back memory-mapped
+    """
+    def __init__(self, directory, num_states=None, num_actions=None, table_key=None, buffer_size=65536):
+        """
+        Opens log in directory, creating it if it does not exist yet; new transitions are appended to existing ones.
+        Buffered transitions reach disk on flush or close, or when the log is used as a context manager
+        :param directory: String
+        :param num_states: Int, size of the state space the ids refer to; required for a new log
+        :param num_actions: Int
+        :param table_key: String, key of the transition table the ids refer to, from CompiledTrack.table_key
+        :param buffer_size: Int, transitions buffered in memory between writes
+        """
+        self.directory = directory
+        self.table_key = None
+        meta_path = os.path.join(directory, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            for name, expected, value in (('states', num_states, meta['num_states']), ('actions', num_actions, meta['num_actions'])):
+                if expected is not None and expected != value:
+                    raise ValueError("Log in {} has {} {}, not {}".format(directory, value, name, expected))
+            num_states, num_actions = meta['num_states'], meta['num_actions']
+            self.table_key = meta.get('table_key')
+            self.count = meta['count']
+        elif num_states is None or num_actions is None:
+            raise ValueError("A new log needs the number of states and actions")
+        else:
+            os.makedirs(directory, exist_ok=True)
+            self.count = 0
+        self.num_states = num_states
+        self.num_actions = num_actions
+        self.buffer = {name: np.empty(buffer_size, dtype=dtype) for name, dtype in COLUMNS}
+        self.buffered = 0
+        # Columns written before a crash may run past the last recorded count; drop the unrecorded tail
+        for name, dtype in COLUMNS:
+            path = self.__column_path(name)
+            if os.path.exists(path) and os.path.getsize(path) > self.count * np.dtype(dtype).itemsize:
+                os.truncate(path, self.count * np.dtype(dtype).itemsize)
+        self.check_table(table_key)
+
+    def __enter__(self):
+        """
+        Returns log
+        :return: TrajectoryLog
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Closes log, also when the block raised
+        :param exc_type: Type
+        :param exc_value: Exception
+        :param traceback: Traceback
+        :return: None
+        """
+        self.close()
+
+    def __len__(self):
+        """
+        Returns number of logged transitions, including buffered ones
+        :return: Int
+        """
+        return self.count + self.buffered
+
+    def __column_path(self, name):
+        """
+        Returns file of given column
+        :param name: String
+        :return: String
+        """
+        return os.path.join(self.directory, name + '.bin')
+
+    def __write_meta(self):
+        """
+        Records number of transitions on disk; replaced atomically, so readers never see a count the columns lack
+        :return: None
+        """
+        with atomic_write(os.path.join(self.directory, META_FILE), 'w') as f:
+            json.dump({'count': self.count, 'num_states': self.num_states, 'num_actions': self.num_actions, 'table_key': self.table_key,
+                       'columns': {name: np.dtype(dtype).str for name, dtype in COLUMNS}}, f)
+
+    def check_table(self, table_key):
+        """
+        Checks that the logged ids refer to given transition table; a log that does not know its table yet is bound to it
+        :param table_key: String, from CompiledTrack.table_key; None skips the check
+        :return: None
+        """
+        if table_key is not None and self.table_key is not None and table_key != self.table_key:
+            raise ValueError("Log in {} was recorded on transition table {}, not {}".format(self.directory, self.table_key, table_key))
+        if table_key is not None:
+            self.table_key = table_key
+        self.__write_meta()
+
+    def append(self, state_id, action_id, reward, next_state_id, done):
+        """
+        Logs one transition
+        :param state_id: Int
+        :param action_id: Int
+        :param reward: Float
+        :param next_state_id: Int
+        :param done: Boolean, next state ends the episode
+        :return: None
+        """
+        if self.buffered == len(self.buffer['state_ids']):
+            self.flush()
+        for (name, _), value in zip(COLUMNS, (state_id, action_id, reward, next_state_id, done)):
+            self.buffer[name][self.buffered] = value
+        self.buffered += 1
+
+    def extend(self, state_ids, action_ids, rewards, next_state_ids, done):
+        """
+        Logs a batch of transitions, copied into the buffer a chunk at a time
+        :param state_ids: Array
+        :param action_ids: Array
+        :param rewards: Array
+        :param next_state_ids: Array
+        :param done: Array
+        :return: None
+        """
+        columns = [np.asarray(values).reshape(-1) for values in (state_ids, action_ids, rewards, next_state_ids, done)]
+        buffer_size = len(self.buffer['state_ids'])
+        start = 0
+        while start < len(columns[0]):
+            if self.buffered == buffer_size:
+                self.flush()
+            stop = min(len(columns[0]), start + buffer_size - self.buffered)
+            for (name, _), values in zip(COLUMNS, columns):
+                self.buffer[name][self.buffered:self.buffered + stop - start] = values[start:stop]
+            self.buffered += stop - start
+            start = stop
+
+    def flush(self):
+        """
+        Writes buffered transitions to disk
+        :return: None
+        """
+        if self.buffered:
+            self.__write([self.buffer[name][:self.buffered] for name, _ in COLUMNS])
+            self.buffered = 0
+
+    def close(self):
+        """
+        Writes buffered transitions to disk; the log can still be appended to afterwards
+        :return: None
+        """
+        self.flush()
+
+    def __write(self, columns):
+        """
+        Appends columns of equal length to their files
+        :param columns: List of Arrays in COLUMNS order
+        :return: None
+        """
+        for (name, _), values in zip(COLUMNS, columns):
+            with open(self.__column_path(name), 'ab') as f:
+                f.write(values.tobytes())
+        self.count += len(columns[0])
+        self.__write_meta()
+
+    def columns(self):
+        """
+        Flushes and returns every column, memory-mapped read-only
+        :return: Dict of Arrays by column name
+        """
+        self.flush()
+        if not self.count:
+            return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS}
+        return {name: np.memmap(self.__column_path(name), dtype=dtype, mode='r', shape=(self.count,)) for name, dtype in COLUMNS}
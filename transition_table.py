@@ -0,0 +1,328 @@
+import numpy as np
+from car import ACTIONS
+from track_compiler import save_arrays
+from racetrack import X_VEL_LO_LIM, X_VEL_UP_LIM, Y_VEL_LO_LIM, Y_VEL_UP_LIM, ACTION_SUCCESS_PROB, ACTION_FAIL_PROB
+
+
+# Velocity grid dimensions
+NUM_X_VELOCITIES = X_VEL_UP_LIM - X_VEL_LO_LIM + 1
+NUM_Y_VELOCITIES = Y_VEL_UP_LIM - Y_VEL_LO_LIM + 1
+NUM_VELOCITIES = NUM_X_VELOCITIES * NUM_Y_VELOCITIES
+
+class TransitionTable:
+    """
+    Class for representing a RaceTrack's transition model as dense integer-indexed arrays
+    """
+    def __init__(self, environment, reachable_only=False, initial_states=None, arrays=None, previous=None):
+        """
+        Enumerates states into dense ids and builds transition, reward and terminal arrays
+        :param environment: RaceTrack
+        :param reachable_only: Boolean, enumerate only states reachable from the initial states
+        :param initial_states: List of Tuples, defaults to the environment's initial state
+        :param arrays: Dict of arrays written by save; restores that table instead of enumerating
+        :param previous: TransitionTable, full table of this track before a layout edit, with the same size, start and
+        crash rule; outcomes of moves whose segment cannot touch an edited wall are copied from it
+        """
+        self.num_rows = environment.num_rows
+        self.num_cols = environment.num_cols
+        self.actions = ACTIONS
+        self.action_index = {action: i for (i, action) in enumerate(self.actions)}
+        self.num_actions = len(self.actions)
+        self.success_prob = ACTION_SUCCESS_PROB
+        self.fail_prob = ACTION_FAIL_PROB
+        self.reachable_only = reachable_only
+        self.predecessor_indptr = None
+        self.predecessor_indices = None
+        self.predecessor_weights = None
+
+        # Number the non-wall cells row by row; walls keep id -1
+        track = environment.track
+        self.cell_index = np.full((self.num_rows, self.num_cols), -1, dtype=np.int32)
+        cell_ys, cell_xs = np.nonzero(~track.wall_mask[:self.num_rows, :self.num_cols])
+        self.cells = np.stack((cell_xs, cell_ys), axis=1).astype(np.int32)
+        self.cell_index[cell_ys, cell_xs] = np.arange(len(self.cells), dtype=np.int32)
+        self.num_cells = len(self.cells)
+        if arrays is not None:
+            self.__restore(arrays)
+            return
+
+        # States are numbered by their full (cell, velocity) id; in reachable-only mode the dense ids
+        # index a sorted subset of full ids instead
+        num_full_states = self.num_cells * NUM_VELOCITIES
+        if reachable_only:
+            if initial_states is None:
+                initial_states = [environment.initial_state]
+            reached, moves = self.__enumerate_reachable(environment, initial_states)
+            self.full_ids = np.array(sorted(reached), dtype=np.int64)
+            self.compact_index = np.full(num_full_states, -1, dtype=np.int32)
+            self.compact_index[self.full_ids] = np.arange(len(self.full_ids), dtype=np.int32)
+        else:
+            # The outcome of a move only depends on the cell and the velocity applied, so each
+            # (cell, velocity) segment is resolved exactly once
+            moves = np.empty(num_full_states, dtype=np.int64)
+            if previous is None:
+                for cell_id, (x, y) in enumerate(self.cells.tolist()):
+                    for vx in range(X_VEL_LO_LIM, X_VEL_UP_LIM + 1):
+                        for vy in range(Y_VEL_LO_LIM, Y_VEL_UP_LIM + 1):
+                            state = (x, y, vx, vy)
+                            moves[self.__full_id(state)] = self.__full_id(environment.move(state, vx, vy))
+            else:
+                for full_id in np.flatnonzero(self.__reuse_moves(environment, previous, moves)).tolist():
+                    cell_id, velocity_id = divmod(full_id, NUM_VELOCITIES)
+                    x, y = (int(v) for v in self.cells[cell_id])
+                    vx = velocity_id // NUM_Y_VELOCITIES + X_VEL_LO_LIM
+                    vy = velocity_id % NUM_Y_VELOCITIES + Y_VEL_LO_LIM
+                    moves[full_id] = self.__full_id(environment.move((x, y, vx, vy), vx, vy))
+            self.full_ids = np.arange(num_full_states, dtype=np.int64)
+            self.compact_index = None
+        self.num_states = len(self.full_ids)
+
+        # Cell and velocity components of every state id
+        cell_ids, velocity_ids = np.divmod(self.full_ids, NUM_VELOCITIES)
+        x_velocities = velocity_ids // NUM_Y_VELOCITIES + X_VEL_LO_LIM
+        y_velocities = velocity_ids % NUM_Y_VELOCITIES + Y_VEL_LO_LIM
+
+        # Successful actions accelerate first; failed actions keep the current velocity
+        self.next_success = np.empty((self.num_states, self.num_actions), dtype=np.int32)
+        for i, action in enumerate(self.actions):
+            new_x_velocities = np.clip(x_velocities + action[0], X_VEL_LO_LIM, X_VEL_UP_LIM)
+            new_y_velocities = np.clip(y_velocities + action[1], Y_VEL_LO_LIM, Y_VEL_UP_LIM)
+            new_velocity_ids = (new_x_velocities - X_VEL_LO_LIM) * NUM_Y_VELOCITIES + new_y_velocities - Y_VEL_LO_LIM
+            self.next_success[:, i] = self.__compact(self.__lookup(moves, cell_ids * NUM_VELOCITIES + new_velocity_ids))
+        fail = self.__compact(self.__lookup(moves, self.full_ids))
+        self.next_fail = np.broadcast_to(fail[:, None], (self.num_states, self.num_actions))
+
+        # Rewards and terminal flags are properties of the cell
+        self.terminal = track.finish_mask[self.cells[cell_ids, 1], self.cells[cell_ids, 0]]
+        self.reward = np.where(self.terminal, 0.0, 1.0)
+
+    def save(self, path):
+        """
+        Writes the state index and transition arrays, so an unchanged track can skip enumeration
+        :param path: String
+        :return: None
+        """
+        arrays = {'full_ids': self.full_ids, 'next_success': self.next_success, 'next_fail': self.next_fail[:, 0],
+                  'terminal': self.terminal}
+        if self.compact_index is not None:
+            arrays['compact_index'] = self.compact_index
+        save_arrays(path, **arrays)
+
+    def __restore(self, arrays):
+        """
+        Restores arrays written by save
+        :param arrays: Dict
+        :return: None
+        """
+        self.full_ids = arrays['full_ids']
+        self.compact_index = arrays.get('compact_index')
+        self.num_states = len(self.full_ids)
+        self.next_success = arrays['next_success']
+        self.next_fail = np.broadcast_to(arrays['next_fail'][:, None], (self.num_states, self.num_actions))
+        self.terminal = arrays['terminal']
+        self.reward = np.where(self.terminal, 0.0, 1.0)
+
+    def __reuse_moves(self, environment, previous, moves):
+        """
+        Copies outcomes of (cell, velocity) moves from previous whose Bresenham segment cannot touch a cell whose wall
+        changed: such a segment stays within the bounding box of its start and its clamped end
+        :param environment: RaceTrack
+        :param previous: TransitionTable
+        :param moves: Array indexed by full id, filled in place
+        :return: Boolean Array of the moves that still need resolving
+        """
+        if previous.reachable_only or (previous.num_rows, previous.num_cols) != (self.num_rows, self.num_cols):
+            raise ValueError("Moves can only be reused from a full table of a track of the same size")
+        full_ids = np.arange(len(moves), dtype=np.int64)
+        cell_ids, velocity_ids = np.divmod(full_ids, NUM_VELOCITIES)
+        x_starts, y_starts = self.cells[cell_ids, 0], self.cells[cell_ids, 1]
+        x_ends = np.clip(x_starts + velocity_ids // NUM_Y_VELOCITIES + X_VEL_LO_LIM, 0, self.num_cols)
+        y_ends = np.clip(y_starts + velocity_ids % NUM_Y_VELOCITIES + Y_VEL_LO_LIM, 0, self.num_rows)
+        x_lows, x_highs = np.minimum(x_starts, x_ends), np.maximum(x_starts, x_ends)
+        y_lows, y_highs = np.minimum(y_starts, y_ends), np.maximum(y_starts, y_ends)
+
+        previous_cell_ids = previous.cell_index[y_starts, x_starts].astype(np.int64)
+        stale = previous_cell_ids < 0
+        changed_ys, changed_xs = np.nonzero((previous.cell_index < 0) != (self.cell_index < 0))
+        for x, y in zip(changed_xs.tolist(), changed_ys.tolist()):
+            stale |= (x_lows <= x) & (x <= x_highs) & (y_lows <= y) & (y <= y_highs)
+
+        reused = np.flatnonzero(~stale)
+        outcomes = previous.decode_many(previous.next_fail[previous_cell_ids[reused] * NUM_VELOCITIES + velocity_ids[reused], 0])
+        outcome_cell_ids = self.cell_index[outcomes[:, 1], outcomes[:, 0]].astype(np.int64)
+        # A reset target that became a wall cannot be copied
+        valid = outcome_cell_ids >= 0
+        stale[reused[~valid]] = True
+        velocities = (outcomes[:, 2] - X_VEL_LO_LIM) * NUM_Y_VELOCITIES + outcomes[:, 3] - Y_VEL_LO_LIM
+        moves[reused[valid]] = (outcome_cell_ids * NUM_VELOCITIES + velocities)[valid]
+        return stale
+
+    def build_predecessor_index(self):
+        """
+        Builds (once) a CSR index from each state to the states that can transition into it. Each edge is
+        weighted by the probability it carries under any single action: success, failure, or both
+        :return: Tuple of index pointer, predecessor and edge weight arrays
+        """
+        if self.predecessor_indptr is None:
+            sources = np.arange(self.num_states, dtype=np.int64)
+            success_edges = np.unique(np.asarray(self.next_success, dtype=np.int64) * self.num_states + sources[:, None])
+            fail_edges = np.unique(np.asarray(self.next_fail, dtype=np.int64) * self.num_states + sources[:, None])
+            edges = np.union1d(success_edges, fail_edges)
+            weights = np.zeros(len(edges))
+            weights[np.searchsorted(edges, success_edges)] += self.success_prob
+            weights[np.searchsorted(edges, fail_edges)] += self.fail_prob
+            targets, sources = np.divmod(edges, self.num_states)
+            self.predecessor_indptr = np.zeros(self.num_states + 1, dtype=np.int64)
+            np.cumsum(np.bincount(targets, minlength=self.num_states), out=self.predecessor_indptr[1:])
+            self.predecessor_indices = sources.astype(np.int32)
+            self.predecessor_weights = weights
+        return self.predecessor_indptr, self.predecessor_indices, self.predecessor_weights
+
+    def predecessor_edges(self, state_ids):
+        """
+        Returns every (predecessor, target) edge into given states
+        :param state_ids: Array
+        :return: Tuple of predecessor ids, positions of their targets within state_ids and edge weights
+        """
+        indptr, indices, weights = self.build_predecessor_index()
+        state_ids = np.asarray(state_ids)
+        starts = indptr[state_ids]
+        counts = indptr[state_ids + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return indices[offsets], np.repeat(np.arange(len(state_ids)), counts), weights[offsets]
+
+    def predecessors(self, state_ids):
+        """
+        Returns distinct states that can transition into any of given states
+        :param state_ids: Array
+        :return: Array
+        """
+        return np.unique(self.predecessor_edges(state_ids)[0])
+
+    def __enumerate_reachable(self, environment, initial_states):
+        """
+        Expands the transition model breadth first from given states
+        :param environment: RaceTrack
+        :param initial_states: List of Tuples
+        :return: Tuple of the set of reachable full ids, and sorted arrays of the full ids of the (cell, velocity)
+        moves they make with the full ids of the moves' outcomes
+        """
+        # Velocities a state with a given velocity can move with next
+        next_velocities = []
+        for vx in range(X_VEL_LO_LIM, X_VEL_UP_LIM + 1):
+            for vy in range(Y_VEL_LO_LIM, Y_VEL_UP_LIM + 1):
+                velocities = {(min(max(vx + ax, X_VEL_LO_LIM), X_VEL_UP_LIM), min(max(vy + ay, Y_VEL_LO_LIM), Y_VEL_UP_LIM))
+                              for (ax, ay) in self.actions}
+                velocities.add((vx, vy))
+                next_velocities.append(sorted(velocities))
+
+        moves = {}
+        reached = {self.__full_id(state) for state in initial_states}
+        frontier = list(reached)
+        while frontier:
+            next_frontier = []
+            for full_id in frontier:
+                cell_id, velocity_id = divmod(full_id, NUM_VELOCITIES)
+                x, y = (int(v) for v in self.cells[cell_id])
+                for vx, vy in next_velocities[velocity_id]:
+                    move_id = cell_id * NUM_VELOCITIES + (vx - X_VEL_LO_LIM) * NUM_Y_VELOCITIES + vy - Y_VEL_LO_LIM
+                    if move_id not in moves:
+                        moves[move_id] = self.__full_id(environment.move((x, y, vx, vy), vx, vy))
+                    outcome = moves[move_id]
+                    if outcome not in reached:
+                        reached.add(outcome)
+                        next_frontier.append(outcome)
+            frontier = next_frontier
+        move_ids = np.array(sorted(moves), dtype=np.int64)
+        return reached, (move_ids, np.array([moves[move_id] for move_id in move_ids], dtype=np.int64))
+
+    @staticmethod
+    def __lookup(moves, move_ids):
+        """
+        Returns full ids of the outcomes of given (cell, velocity) moves
+        :param moves: Array indexed by full id, or Tuple of sorted move ids and outcomes
+        :param move_ids: Array
+        :return: Array
+        """
+        if isinstance(moves, np.ndarray):
+            return moves[move_ids]
+        keys, outcomes = moves
+        return outcomes[np.searchsorted(keys, move_ids)]
+
+    def __full_id(self, state):
+        """
+        Returns (cell, velocity) id of given state, independent of which states are enumerated
+        :param state: Tuple
+        :return: Int
+        """
+        cell_id = int(self.cell_index[state[1], state[0]])
+        return cell_id * NUM_VELOCITIES + (state[2] - X_VEL_LO_LIM) * NUM_Y_VELOCITIES + state[3] - Y_VEL_LO_LIM
+
+    def __compact(self, full_ids):
+        """
+        Maps full ids to dense state ids
+        :param full_ids: Array
+        :return: Array
+        """
+        return full_ids if self.compact_index is None else self.compact_index[full_ids]
+
+    def encode(self, state):
+        """
+        Returns dense id of given state, or -1 for a state that is not enumerated
+        :param state: Tuple
+        :return: Int
+        """
+        full_id = self.__full_id(state)
+        return full_id if self.compact_index is None else int(self.compact_index[full_id])
+
+    def encode_many(self, states):
+        """
+        Returns dense ids of given states
+        :param states: Array of shape (N, 4)
+        :return: Array
+        """
+        states = np.asarray(states)
+        cell_ids = self.cell_index[states[:, 1], states[:, 0]].astype(np.int64)
+        full_ids = cell_ids * NUM_VELOCITIES + (states[:, 2] - X_VEL_LO_LIM) * NUM_Y_VELOCITIES + states[:, 3] - Y_VEL_LO_LIM
+        return self.__compact(full_ids)
+
+    def decode(self, state_id):
+        """
+        Returns state with given dense id
+        :param state_id: Int
+        :return: Tuple
+        """
+        cell_id, velocity_id = divmod(int(self.full_ids[state_id]), NUM_VELOCITIES)
+        x, y = self.cells[cell_id]
+        return (int(x), int(y), velocity_id // NUM_Y_VELOCITIES + X_VEL_LO_LIM, velocity_id % NUM_Y_VELOCITIES + Y_VEL_LO_LIM)
+
+    def decode_many(self, state_ids):
+        """
+        Returns states with given dense ids
+        :param state_ids: Array
+        :return: Array of shape (N, 4)
+        """
+        cell_ids, velocity_ids = np.divmod(self.full_ids[np.asarray(state_ids)], NUM_VELOCITIES)
+        states = np.empty((len(cell_ids), 4), dtype=np.int64)
+        states[:, :2] = self.cells[cell_ids]
+        states[:, 2] = velocity_ids // NUM_Y_VELOCITIES + X_VEL_LO_LIM
+        states[:, 3] = velocity_ids % NUM_Y_VELOCITIES + Y_VEL_LO_LIM
+        return states
+
+    def get_all_states(self):
+        """
+        Returns state space in id order
+        :return: List
+        """
+        return [self.decode(state_id) for state_id in range(self.num_states)]
+
+def load_transition_table(path, environment):
+    """
+    Loads transition table written by TransitionTable.save
+    :param path: String
+    :param environment: RaceTrack the table was built for
+    :return: TransitionTable
+    """
+    with np.load(path) as cached:
+        arrays = {name: cached[name] for name in cached.files}
+    return TransitionTable(environment, reachable_only='compact_index' in arrays, arrays=arrays)
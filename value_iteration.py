@@ -1,13 +1,38 @@
 import numpy as np
 from copy import deepcopy
 import matplotlib.pyplot as plt
+from tables import ValueTable
+from checkpoint import save_checkpoint
+from policy import compile_policy
+from multigrid import coarsen_track, prolongate
+from racetrack import RaceTrack
+from telemetry import Telemetry, QUIET, EPISODE, STEP
 
 
+def bellman_backup(values, reward, next_success, next_fail, discount, success_prob, fail_prob):
+    """
+    Computes Bellman backups for the states whose rewards and successor rows are given
+    :param values: Array
+    :param reward: Array of shape (N,)
+    :param next_success: Array of shape (N, num_actions)
+    :param next_fail: Array of shape (N, num_actions)
+    :param discount: Float
+    :param success_prob: Float
+    :param fail_prob: Float
+    :return: Array
+    """
+    # Same operation order as the dict engine, so both converge to identical values
+    state_action_values = reward[:, None] + discount * success_prob * values[next_success]
+    state_action_values += discount * fail_prob * values[next_fail]
+    return state_action_values.min(axis=1)
+
 class ValueIteration:
     """
     Class that implements the Value Iteration algorithm
     """
-    def __init__(self, discount, threshold, max_iterations, environment, agent):
+    def __init__(self, discount, threshold, max_iterations, environment, agent, engine='python', update='synchronous', block_size=4096,
+                 telemetry=None, initial_values=None, checkpoint_path=None, checkpoint_every=None, multigrid_levels=0, multigrid_factor=2,
+                 changed_states=None):
         """
         Initializes algorithm
         :param discount: Float
@@ -15,13 +40,46 @@ class ValueIteration:
         :param max_iterations: Int
         :param environment: RaceTrack
         :param agent: Car
+        :param engine: String, 'python' (dict-based) or 'vectorized' (array-based)
+        :param update: String, 'synchronous' (Jacobi), 'in_place' (Gauss-Seidel) or 'prioritized'
+        (asynchronous prioritized sweeping); vectorized engine only
+        :param block_size: Int, number of states backed up together by in-place and prioritized updates
+        :param telemetry: Telemetry
+        :param initial_values: Array in transition table order to start from instead of zeros, e.g. from
+        Checkpoint.values_for
+        :param checkpoint_path: String, value function is checkpointed here at the end of the run, also an interrupted one
+        :param checkpoint_every: Int, also checkpoint every this many sweeps
+        :param multigrid_levels: Int, vectorized engine only: start from the interpolated solution of a track coarsened
+        this many times instead of zeros
+        :param multigrid_factor: Int, cells merged along each axis per coarsening
+        :param changed_states: Array of state ids whose transitions or rewards changed since initial_values converged;
+        prioritized updates then only seed the queue with these states and their predecessors
         """
         self.discount = discount
         self.threshold = threshold
         self.max_iterations = max_iterations
         self.environment = environment
         self.agent = agent
-        self.max_diffs = []
+        self.engine = engine
+        self.update = update
+        self.block_size = block_size
+        self.telemetry = Telemetry() if telemetry is None else telemetry
+        self.num_backups = 0
+        self.initial_values = initial_values
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.multigrid_levels = multigrid_levels
+        self.multigrid_factor = multigrid_factor
+        self.coarse_sweeps = 0
+        self.changed_states = changed_states
+
+    @property
+    def max_diffs(self):
+        """
+        Returns maximum value difference of every sweep (or prioritized batch)
+        :return: List
+        """
+        return self.telemetry.history('max_diff')
 
     def __initialize_values(self):
         """
@@ -31,67 +89,221 @@ class ValueIteration:
         self.all_states = self.environment.get_all_states()
         self.all_actions = self.agent.get_all_actions()
         self.value_function = {k: v for (k, v) in zip(self.all_states, np.zeros(len(self.all_states)))}
+        if self.initial_values is not None:
+            initial_values = ValueTable(self.environment.compile(), self.initial_values)
+            self.value_function = {k: initial_values.get(k, 0.0) for k in self.value_function}
 
     def run(self):
         """
         Runs algorithm
         :return: Dict
         """
+        if self.engine == 'vectorized':
+            return self.__run_vectorized()
         self.__initialize_values()
         differences = [np.inf for _ in range(len(self.value_function))]
         i = 0
-        while i < self.max_iterations and max(differences) > self.threshold:
-            new_value_function = deepcopy(self.value_function)
-            for state in self.all_states:
-                self.environment.set_state(state)
-                state_action_pairs = [(state, action) for _ in range(1) for action in self.all_actions]
-                state_action_function = {k: v for (k, v) in zip(state_action_pairs, np.zeros(len(self.all_actions)))}
-                for action in self.all_actions:
-                    state_action_function[(state, action)] = self.environment.reward()
-                    next_possible_states = self.environment.next_states(action)
-                    for possible_state in next_possible_states:
-                        next_state = possible_state[0]
-                        probability = possible_state[1]
-                        state_action_function[(state, action)] += self.discount * probability * self.value_function[next_state]
-                new_value_function[state] = min(state_action_function.values())
-            differences = np.array(list(new_value_function.values()) - np.array(list(self.value_function.values())))
-            print("Maximum difference: ", max(differences))
-            self.max_diffs.append(max(differences))
-            self.value_function = new_value_function
-            i += 1
-            print("Iterations: ", i)
+        try:
+            while i < self.max_iterations and max(differences) > self.threshold:
+                new_value_function = deepcopy(self.value_function)
+                for state in self.all_states:
+                    self.environment.set_state(state)
+                    state_action_pairs = [(state, action) for _ in range(1) for action in self.all_actions]
+                    state_action_function = {k: v for (k, v) in zip(state_action_pairs, np.zeros(len(self.all_actions)))}
+                    for action in self.all_actions:
+                        state_action_function[(state, action)] = self.environment.reward()
+                        next_possible_states = self.environment.next_states(action)
+                        for possible_state in next_possible_states:
+                            next_state = possible_state[0]
+                            probability = possible_state[1]
+                            state_action_function[(state, action)] += self.discount * probability * self.value_function[next_state]
+                    new_value_function[state] = min(state_action_function.values())
+                differences = np.array(list(new_value_function.values()) - np.array(list(self.value_function.values())))
+                self.telemetry.log(EPISODE, "Maximum difference: ", max(differences))
+                self.telemetry.record('max_diff', max(differences))
+                self.value_function = new_value_function
+                i += 1
+                self.telemetry.log(EPISODE, "Iterations: ", i)
+                if self.checkpoint_every and i % self.checkpoint_every == 0:
+                    self.save_checkpoint(self.value_array(), i)
+        finally:
+            # An interrupted run still keeps its last completed sweep
+            if self.checkpoint_path is not None:
+                self.save_checkpoint(self.value_array(), i)
+        self.telemetry.flush()
+        return self.value_function
+
+    def __run_vectorized(self):
+        """
+        Runs algorithm with batched Bellman backups over the compiled transition table
+        :return: ValueTable
+        """
+        self.transition_table = self.environment.compile()
+        self.all_actions = self.agent.get_all_actions()
+        values = np.zeros(self.transition_table.num_states) if self.initial_values is None else np.array(self.initial_values, dtype=np.float64)
+        if self.initial_values is None and self.multigrid_levels:
+            values = self.__coarse_values()
+        if self.update == 'prioritized':
+            return self.__run_prioritized(values)
+        max_difference = np.inf
+        i = 0
+        completed = values
+        try:
+            while i < self.max_iterations and max_difference > self.threshold:
+                if self.update == 'in_place':
+                    # Until the sweep finishes, its copy holds the last completed sweep
+                    old_values = completed = values.copy()
+                    for start in range(0, len(values), self.block_size):
+                        block = slice(start, start + self.block_size)
+                        values[block] = self.backup(values, block)
+                    max_difference = np.max(np.abs(values - old_values))
+                else:
+                    new_values = self.backup(values)
+                    # Absolute, so warm starts from above also run to convergence; from zeros values only grow
+                    max_difference = np.max(np.abs(new_values - values))
+                    values = new_values
+                self.telemetry.log(EPISODE, "Maximum difference: ", max_difference)
+                self.telemetry.record('max_diff', max_difference)
+                self.num_backups += len(values)
+                i += 1
+                completed = values
+                self.telemetry.log(EPISODE, "Iterations: ", i)
+                if self.checkpoint_every and i % self.checkpoint_every == 0:
+                    self.save_checkpoint(values, i)
+        finally:
+            # An interrupted run still keeps its last completed sweep
+            self.save_checkpoint(completed, i)
+        self.value_function = ValueTable(self.transition_table, values)
+        self.telemetry.flush()
+        return self.value_function
+
+    def __coarse_values(self):
+        """
+        Solves a coarsened copy of the track, recursively coarsening further while levels remain, and interpolates
+        its values onto this track's states
+        :return: Array
+        """
+        environment = self.environment
+        factor = self.multigrid_factor
+        rows, cols, layout = coarsen_track(environment.num_rows, environment.num_cols, environment.layout, factor)
+        x_start, y_start = environment.initial_state[:2]
+        coarse_environment = RaceTrack(rows, cols, layout, (x_start // factor, y_start // factor, 0, 0),
+                                       reset_on_crash=environment.reset_on_crash)
+        coarse = ValueIteration(self.discount, self.threshold, self.max_iterations, coarse_environment, self.agent, engine='vectorized',
+                                update=self.update, block_size=self.block_size, telemetry=Telemetry(QUIET),
+                                multigrid_levels=self.multigrid_levels - 1, multigrid_factor=factor)
+        coarse_values = coarse.run().array
+        self.coarse_sweeps = coarse.coarse_sweeps + len(coarse.max_diffs)
+        self.num_backups += coarse.num_backups
+        self.telemetry.log(EPISODE, "Coarse sweeps: ", self.coarse_sweeps)
+        return prolongate(coarse_environment.compile(), coarse_values, self.transition_table, factor)
+
+    def __run_prioritized(self, values):
+        """
+        Runs asynchronous prioritized sweeping. Each state's priority bounds its Bellman error: it starts
+        at the exact error and grows by discount * probability * |change| whenever a successor is backed
+        up. States are backed up highest priority first until no priority exceeds the threshold, or after
+        max_iterations sweeps' worth of backups
+        :param values: Array
+        :return: ValueTable
+        """
+        table = self.transition_table
+        table.build_predecessor_index()
+        if self.changed_states is None:
+            priorities = np.abs(self.backup(values) - values)
+            self.num_backups += len(values)
+        else:
+            # Every other state already satisfied its Bellman equation under the converged values
+            seeds = np.union1d(self.changed_states, table.predecessors(self.changed_states)).astype(np.int64)
+            priorities = np.zeros(len(values))
+            priorities[seeds] = np.abs(self.backup(values, seeds) - values[seeds])
+            self.num_backups += len(seeds)
+        max_backups = self.max_iterations * len(values)
+        try:
+            while self.num_backups < max_backups:
+                # Take the highest-priority states off the queue
+                batch = np.argpartition(priorities, -self.block_size)[-self.block_size:] if self.block_size < len(values) else np.arange(len(values))
+                batch = batch[priorities[batch] > self.threshold]
+                if not len(batch):
+                    break
+                priorities[batch] = 0
+                new_values = self.backup(values, batch)
+                changes = new_values - values[batch]
+                values[batch] = new_values
+                self.num_backups += len(batch)
+                self.telemetry.record('max_diff', np.max(np.abs(changes)))
+
+                # Raise the error bound of every state whose successors just changed
+                predecessors, targets, weights = table.predecessor_edges(batch)
+                np.add.at(priorities, predecessors, self.discount * weights * np.abs(changes[targets]))
+        finally:
+            # Every batch is applied at once, so an interrupted run keeps every finished batch
+            self.save_checkpoint(values, self.num_backups)
+        self.telemetry.log(EPISODE, "Backups: ", self.num_backups)
+        self.value_function = ValueTable(self.transition_table, values)
+        self.telemetry.flush()
         return self.value_function
 
+    def save_checkpoint(self, values, iteration):
+        """
+        Checkpoints value function if a checkpoint path is set
+        :param values: Array in the state order of the compiled transition table
+        :param iteration: Int
+        :return: None
+        """
+        if self.checkpoint_path is not None:
+            save_checkpoint(self.checkpoint_path, self.environment.compile(), values, 'value', iteration=iteration, discount=self.discount)
+
+    def backup(self, values, states=slice(None)):
+        """
+        Computes Bellman backups for given states from given values
+        :param values: Array
+        :param states: Slice or Array of state ids
+        :return: Array
+        """
+        table = self.transition_table
+        return bellman_backup(values, table.reward[states], table.next_success[states], table.next_fail[states],
+                              self.discount, table.success_prob, table.fail_prob)
+
+    def value_array(self):
+        """
+        Returns trained values in the state order of the compiled transition table
+        :return: Array
+        """
+        table = self.environment.compile()
+        if isinstance(self.value_function, ValueTable) and self.value_function.transition_table is table:
+            return self.value_function.array
+        return np.array([self.value_function.get(state, 0.0) for state in table.get_all_states()])
+
+    def compile_policy(self):
+        """
+        Compiles greedy policy with respect to the expected one-step backup of the trained value function
+        :return: Array of int8 action ids, indexed by state id of the compiled transition table
+        """
+        return compile_policy(self.environment.compile(), self.value_array(), discount=self.discount)
+
     def extract_policy(self, state):
         """
         Extracts and follows policy using trained value function
         :param state: Tuple
         :return: List
         """
+        table = self.environment.compile()
+        policy = self.compile_policy()
         self.environment.set_state(state)
         current_state = state
         path = [current_state]
-        track = self.environment.layout
-        while track[current_state[1]][current_state[0]] != 'F':
-            next_action = (0, 0)
+        log_steps = self.telemetry.enabled(STEP)
+        finish_mask = self.environment.track.finish_mask
+        while not finish_mask[current_state[1], current_state[0]]:
+            next_action = table.actions[policy[table.encode(current_state)]]
             orig_state = current_state
-            optimal_state, optimal_value = current_state, np.inf
-            for action in self.all_actions:
-                self.environment.update_state(action)
-                new_state = self.environment.get_state()
-                action_value = self.value_function[new_state]
-                if action_value < optimal_value:
-                    optimal_state = new_state
-                    optimal_value = action_value
-                    next_action = action
-                self.environment.set_state(current_state)
-            current_state = optimal_state
-            current_value = optimal_value
-            current_state = self.environment.update_state(next_action, indicate_random=True)
-            # print(current_state, current_value, track[current_state[1]][current_state[0]])
-            print(orig_state, current_state, next_action, '\n')
+            current_state = self.environment.update_state(next_action, indicate_random=log_steps)
+            if log_steps:
+                self.telemetry.log(STEP, orig_state, current_state, next_action, '\n')
             path.append(current_state)
-        print("Finished training---------------------------------------")
+        self.telemetry.log(EPISODE, "Finished training---------------------------------------")
+        self.telemetry.flush()
         return path
 
     def plot_max_diffs(self):
@@ -0,0 +1,133 @@
+import numpy as np
+from random_source import RandomSource
+from track_compiler import CompiledTrack
+from racetrack import X_VEL_LO_LIM, X_VEL_UP_LIM, Y_VEL_LO_LIM, Y_VEL_UP_LIM, ACTION_SUCCESS_PROB
+
+
+class VectorRaceTrack:
+    """
+    Class for stepping many cars through the RaceTrack environment at once
+    """
+    def __init__(self, num_rows, num_cols, layout, initial_state, num_cars, reset_on_crash=False, random_source=None, track=None):
+        """
+        Initializes class
+        :param num_rows: Int
+        :param num_cols: Int
+        :param layout: List
+        :param initial_state: Tuple
+        :param num_cars: Int
+        :param reset_on_crash: Boolean
+        :param random_source: RandomSource
+        :param track: CompiledTrack, compiled from layout if None
+        """
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.layout = layout
+        self.initial_state = np.array(initial_state, dtype=np.int64)
+        self.num_cars = num_cars
+        self.reset_on_crash = reset_on_crash
+        self.random_source = RandomSource() if random_source is None else random_source
+
+        # Positions are clamped to [0, num_cols] x [0, num_rows], so the masks have an extra wall row and column
+        track = CompiledTrack(num_rows, num_cols, layout) if track is None else track
+        self.wall_mask = track.wall_mask
+        self.finish_mask = track.finish_mask
+        self.states = np.tile(self.initial_state, (num_cars, 1))
+
+    def get_state(self):
+        """
+        Returns current states of all cars
+        :return: Array of shape (num_cars, 4)
+        """
+        return self.states
+
+    def reset_state(self, cars=None):
+        """
+        Resets given cars (all by default) to initial state
+        :param cars: Array of car indices or boolean mask
+        :return: Array of shape (num_cars, 4)
+        """
+        if cars is None:
+            self.states[:] = self.initial_state
+        else:
+            self.states[cars] = self.initial_state
+        return self.states
+
+    def in_terminal_state(self):
+        """
+        Indicates which cars are on the finish line
+        :return: Array of Booleans
+        """
+        return self.finish_mask[self.states[:, 1], self.states[:, 0]]
+
+    def step(self, actions):
+        """
+        Applies given accelerations to all cars, succeeding with probability ACTION_SUCCESS_PROB,
+        and resets cars that reach the finish line
+        :param actions: Array of shape (num_cars, 2)
+        :return: Tuple of next states (before reset), rewards and terminal flags
+        """
+        actions = np.asarray(actions)
+        success = self.random_source.uniforms(self.num_cars) < ACTION_SUCCESS_PROB
+        x_velocities = np.clip(self.states[:, 2] + np.where(success, actions[:, 0], 0), X_VEL_LO_LIM, X_VEL_UP_LIM)
+        y_velocities = np.clip(self.states[:, 3] + np.where(success, actions[:, 1], 0), Y_VEL_LO_LIM, Y_VEL_UP_LIM)
+        x_targets = np.clip(self.states[:, 0] + x_velocities, 0, self.num_cols)
+        y_targets = np.clip(self.states[:, 1] + y_velocities, 0, self.num_rows)
+
+        x_positions, y_positions, collisions = self.trace(self.states[:, 0], self.states[:, 1], x_targets, y_targets)
+        next_states = np.stack([x_positions, y_positions, x_velocities, y_velocities], axis=1)
+        if self.reset_on_crash:
+            next_states[collisions] = self.initial_state
+        else:
+            next_states[collisions, 2:] = 0
+
+        done = self.finish_mask[next_states[:, 1], next_states[:, 0]]
+        rewards = np.where(done, 0, 1)
+        self.states = next_states.copy()
+        self.states[done] = self.initial_state
+        return next_states, rewards, done
+
+    def trace(self, x0, y0, x1, y1):
+        """
+        Walks Bresenham lines for all cars at once and stops each one before its first wall
+        :param x0: Array
+        :param y0: Array
+        :param x1: Array
+        :param y1: Array
+        :return: Tuple of last free x positions, y positions and collision flags
+        """
+        x_change = x1 - x0
+        y_change = y1 - y0
+        x_sign = np.where(x_change > 0, 1, -1)
+        y_sign = np.where(y_change > 0, 1, -1)
+        x_change = np.abs(x_change)
+        y_change = np.abs(y_change)
+
+        # Step along the major axis, as RaceTrack.bresenham does
+        x_major = x_change > y_change
+        major = np.where(x_major, x_change, y_change)
+        minor = np.where(x_major, y_change, x_change)
+        xx = np.where(x_major, x_sign, 0)
+        xy = np.where(x_major, 0, y_sign)
+        yx = np.where(x_major, 0, x_sign)
+        yy = np.where(x_major, y_sign, 0)
+
+        D = 2 * minor - major
+        y = np.zeros_like(major)
+        x_positions = x0.copy()
+        y_positions = y0.copy()
+        collisions = np.zeros(len(x0), dtype=bool)
+        for x in range(int(major.max(initial=0)) + 1):
+            active = (x <= major) & ~collisions
+            line_x = np.clip(x0 + x * xx + y * yx, 0, self.num_cols)
+            line_y = np.clip(y0 + x * xy + y * yy, 0, self.num_rows)
+            hit = active & self.wall_mask[line_y, line_x]
+            free = active & ~hit
+            collisions |= hit
+            x_positions[free] = line_x[free]
+            y_positions[free] = line_y[free]
+            step = D >= 0
+            y += step
+            D -= 2 * major * step
+            D += 2 * minor
+        return x_positions, y_positions, collisions